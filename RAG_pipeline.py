@@ -1,24 +1,62 @@
+import hashlib
 import logging
 import weaviate
+from bm25_index import LocalBM25Retriever
 from config import Config
-from document_retriever import WeaviateRetriever
+from embeddings import load_embedder
+from cache import AnswerCache, CorpusVersion, LRUCache, normalize_query
+from document_retriever import WeaviateRetriever, doc_list_size
 from jan_ai_service import JanAIPromptNode
-from prompt_templates import get_prompt
+from metrics import QUERIES_IN_FLIGHT, STAGE_SECONDS, TRUNCATIONS
+from prompt_templates import get_prompt, get_template
+from reranker import Reranker
 from tokenizer import Tokenizer
+from token_budget import allocate_budget, build_context, fit_history
 import asyncio
+import contextlib
+from typing import (Any, AsyncContextManager, AsyncIterator, Callable, Dict, List, NamedTuple, Optional,
+                    Tuple)
 from conversation_manager import ConversationManager
 
 logger = logging.getLogger(__name__)
 
+
+class PreparedQuery(NamedTuple):
+    # Prompt to send to the LLM; None when the query is answered without a generation
+    prompt: Optional[str]
+    # Final answer when prompt is None (a cached answer or a user-facing error message)
+    answer: Optional[str] = None
+    # True when answer came from the answer cache and should be saved to history like a generated one
+    cached: bool = False
+    # Answer cache key to store the generated answer under, for stateless queries
+    cache_key: Optional[str] = None
+
+
 # This file contains the RAGPipeline class, which orchestrates the retrieval-augmented generation process.
 class RAGPipeline:
     def __init__(self, max_history=20, max_tokens=32000):
         self.retriever = None
+        self.reranker = None
         self.prompt_node = None
         self.max_history = max_history
         self.max_tokens = max_tokens
-        self.tokenizer = Tokenizer()
-        self.conversation_manager = ConversationManager()
+        self.tokenizer = Tokenizer(vocab_path=Config.TOKENIZER_PATH or None, cache_size=Config.TOKENIZER_CACHE_SIZE)
+        self.conversation_manager = ConversationManager(
+            reader_pool_size=Config.CONVERSATION_READER_POOL_SIZE,
+            write_batch_size=Config.CONVERSATION_WRITE_BATCH_SIZE,
+        )
+        self.corpus_version = CorpusVersion(Config.CORPUS_VERSION_FILE, Config.CORPUS_VERSION_CHECK_INTERVAL)
+        # Chunk summaries memoized by the hash of the chunk text, shared across turns and sessions
+        self.summary_cache = LRUCache(max_entries=Config.SUMMARY_CACHE_MAX_ENTRIES)
+        self.summary_semaphore = asyncio.Semaphore(max(Config.SUMMARY_CONCURRENCY, 1))
+        self.answer_cache = None
+        if Config.ANSWER_CACHE_ENABLED:
+            self.answer_cache = AnswerCache(
+                max_entries=Config.ANSWER_CACHE_MAX_ENTRIES,
+                ttl=Config.ANSWER_CACHE_TTL,
+                db_path=Config.ANSWER_CACHE_PATH or None,
+                version=self.corpus_version,
+            )
         logger.info(f"RAGPipeline initialized with max_history={max_history}, max_tokens={max_tokens}")
 
     def initialize(self):
@@ -28,142 +66,507 @@ class RAGPipeline:
         API) that runs the LLM server.
         """
         try:
-            client = weaviate.Client(Config.WEAVIATE_URL)
-            self.retriever = WeaviateRetriever(client)
+            retrieval_cache = None
+            if Config.RETRIEVAL_CACHE_ENABLED:
+                retrieval_cache = LRUCache(
+                    max_entries=Config.RETRIEVAL_CACHE_MAX_ENTRIES,
+                    max_bytes=Config.RETRIEVAL_CACHE_MAX_BYTES,
+                    ttl=Config.RETRIEVAL_CACHE_TTL,
+                    sizeof=doc_list_size,
+                    version=self.corpus_version,
+                )
+            if Config.RETRIEVER_BACKEND == "local":
+                self.retriever = LocalBM25Retriever(
+                    Config.LOCAL_INDEX_PATH,
+                    cache=retrieval_cache,
+                    neighbor_chunks=Config.RETRIEVAL_NEIGHBOR_CHUNKS,
+                    version=self.corpus_version,
+                    mode=Config.RETRIEVAL_MODE,
+                    candidates=Config.HYBRID_CANDIDATES,
+                    rrf_k=Config.RRF_K,
+                    nprobe=Config.VECTOR_NPROBE,
+                )
+            else:
+                client = weaviate.Client(Config.WEAVIATE_URL)
+                embedder = None
+                if Config.RETRIEVAL_MODE != "bm25":
+                    embedder = load_embedder(Config.EMBEDDER, Config.EMBEDDING_DIM)
+                self.retriever = WeaviateRetriever(
+                    client,
+                    max_workers=Config.RETRIEVER_MAX_WORKERS,
+                    cache=retrieval_cache,
+                    neighbor_chunks=Config.RETRIEVAL_NEIGHBOR_CHUNKS,
+                    mode=Config.RETRIEVAL_MODE,
+                    embedder=embedder,
+                    candidates=Config.HYBRID_CANDIDATES,
+                    rrf_k=Config.RRF_K,
+                )
+            if Config.RERANK_ENABLED:
+                self.reranker = Reranker(
+                    load_embedder(Config.EMBEDDER or "hashing", Config.EMBEDDING_DIM),
+                    mmr_lambda=Config.RERANK_MMR_LAMBDA,
+                    duplicate_threshold=Config.RERANK_DUPLICATE_THRESHOLD,
+                )
             self.prompt_node = JanAIPromptNode(
                 api_url=Config.JANAI_API_URL,
                 model_name=Config.JANAI_MODEL_NAME,
                 max_tokens=Config.JANAI_MAX_TOKENS,
                 max_retries=Config.MAX_RETRIES,
                 base_delay=Config.BASE_DELAY,
-                api_key=Config.JANAI_API_KEY
+                api_key=Config.JANAI_API_KEY,
+                pool_limit=Config.JANAI_POOL_LIMIT,
+                pool_limit_per_host=Config.JANAI_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=Config.JANAI_KEEPALIVE_TIMEOUT,
+                dns_cache_ttl=Config.JANAI_DNS_CACHE_TTL,
+                api_urls=Config.JANAI_API_URLS,
+                max_failures=Config.JANAI_MAX_FAILURES,
+                ejection_time=Config.JANAI_EJECTION_TIME,
+                request_timeout=Config.JANAI_REQUEST_TIMEOUT,
             )
             logger.info("RAGPipeline components initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing the RAG pipeline: {e}", exc_info=True)
             raise
 
+    async def start(self):
+        """
+        Open long-lived network resources (the pooled LLM HTTP session). Call once from the running event loop after
+        initialize().
+        """
+        if self.prompt_node is not None:
+            await self.prompt_node.open()
+
+    async def shutdown(self):
+        """Release network resources opened by start(), the retriever thread pool and the history store."""
+        if self.prompt_node is not None:
+            await self.prompt_node.close()
+        if self.retriever is not None:
+            self.retriever.close()
+        await asyncio.to_thread(self.conversation_manager.close)
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+        logger.info("RAGPipeline shut down")
+
     def count_tokens(self, text):
-        return self.tokenizer.estimate_tokens(text)
+        return self.tokenizer.count_tokens(text)
+
+    def count_tokens_batch(self, texts):
+        return self.tokenizer.count_tokens_batch(texts)
 
     async def summarize_conversation_chunk(self, chunk):
+        key = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+        summary = self.summary_cache.get(key)
+        if summary is not None:
+            return summary
         summary_prompt = f"Summarize the following conversation chunk concisely, preserving key points:\n\n{chunk}"
-        summary = await self.prompt_node.prompt(summary_prompt)
+        async with self.summary_semaphore:
+            with STAGE_SECONDS.time("summarize"):
+                summary = await self.prompt_node.prompt(summary_prompt)
+        self.summary_cache.set(key, summary)
         return summary
 
-    async def truncate_context(self, context, query, history):
-        try:
-            context_tokens = self.count_tokens(context)
-            query_tokens = self.count_tokens(query)
-            history_tokens = [self.count_tokens(msg['content']) for msg in history]
+    @staticmethod
+    def _with_summary(summary, messages):
+        if not summary:
+            return list(messages)
+        return [{"role": "system", "content": f"Summary: {summary}"}] + list(messages)
 
-            total_tokens = context_tokens + query_tokens + sum(history_tokens)
-            logger.info(f"Initial total tokens: {total_tokens}")
+    @staticmethod
+    def _format_message(msg):
+        # Same rendering as the history block in prompt_templates.get_prompt
+        return f"{msg['role']}: {msg['content']}"
 
-            # First, truncate context if necessary
-            while total_tokens > self.max_tokens and context_tokens > 0:
-                try:
-                    context_words = context.split()
-                    if len(context_words) <= 2:
-                        logger.warning("Context too short to truncate further")
-                        break
-                    context = ' '.join(
-                        context_words[len(context_words) // 8:-len(context_words) // 8])  # Remove first and last eighth
-                    context_tokens = self.count_tokens(context)
-                    total_tokens = context_tokens + query_tokens + sum(history_tokens)
-                    logger.info(f"Truncated context. New context tokens: {context_tokens}")
-                except Exception as e:
-                    logger.error(f"Error during context truncation: {e}")
-                    break
+    async def fold_history(self, session_id, summary, messages, counts, history_budget):
+        """
+        Fold the oldest messages into the session's rolling summary so the history fits history_budget: a quarter of
+        the budget is left for the summary and the newest messages fill the rest verbatim. The updated summary is
+        persisted with the id of the last folded message as its watermark, so later turns reuse it and only ever
+        summarize messages newer than that.
+
+        :param session_id: Session whose summary is updated
+        :param summary: The session's current summary ("" if none)
+        :param messages: Messages newer than the current watermark, oldest first
+        :param counts: Token count of each rendered message, aligned with messages
+        :param history_budget: Tokens available for the whole history block
+        :return: (summary, kept_messages)
+        """
+        chunk_token_limit = max(self.max_tokens // 4, 1)  # Ensure chunk_token_limit is at least 1
+        summary_limit = max(history_budget // 4, 1)
+        keep_limit = history_budget - summary_limit
+
+        # Walk back from the newest message; the newest one is always kept
+        split = len(messages)
+        kept_tokens = 0
+        for i in range(len(messages) - 1, -1, -1):
+            if split < len(messages) and kept_tokens + counts[i] > keep_limit:
+                break
+            kept_tokens += counts[i]
+            split = i
+        to_fold, kept = messages[:split], messages[split:]
+        if not to_fold:
+            return summary, kept
+
+        chunks = []
+        current_chunk = []
+        current_chunk_tokens = 0
+        for msg, msg_tokens in zip(to_fold, counts[:split]):
+            if current_chunk and current_chunk_tokens + msg_tokens > chunk_token_limit:
+                chunks.append(current_chunk)
+                current_chunk = []
+                current_chunk_tokens = 0
+            current_chunk.append(msg)
+            current_chunk_tokens += msg_tokens
+        if current_chunk:
+            chunks.append(current_chunk)
+
+        # Chunks are summarized concurrently (capped by summary_semaphore); gather keeps their order
+        chunk_summaries = await asyncio.gather(*[
+            self.summarize_conversation_chunk("\n".join([self._format_message(m) for m in chunk]))
+            for chunk in chunks
+        ])
+
+        new_summary = "\n".join(([summary] if summary else []) + list(chunk_summaries))
+        if self.count_tokens(new_summary) > summary_limit:
+            # Keep the rolling summary itself bounded
+            new_summary = await self.summarize_conversation_chunk(new_summary)
 
-            # Now, apply sliding window summarization to history
-            if total_tokens > self.max_tokens:
+        folded_ids = [m['id'] for m in to_fold if 'id' in m]
+        if folded_ids:
+            self.conversation_manager.save_summary(session_id, new_summary, max(folded_ids))
+        logger.info("Folded %d messages into the rolling summary for session %s", len(to_fold), session_id)
+        return new_summary, kept
+
+    async def truncate_context(self, docs, query, history, session_id="default", template="default"):
+        """
+        Fit retrieved documents and conversation history into max_tokens in a single pass.
+
+        The template and query are reserved as measured; the rest is split between history (HISTORY_BUDGET_SHARE) and
+        context. History over its share is folded into the session's rolling summary, and whatever history leaves
+        unused goes to the context, which is filled from per-document token counts.
+
+        :return: (context, history)
+        """
+        context = ""
+        try:
+            budget = allocate_budget(
+                self.max_tokens,
+                self.count_tokens(get_template(template)),
+                self.count_tokens(query),
+                Config.HISTORY_BUDGET_SHARE,
+            )
+
+            # Messages already folded into the stored summary are represented by the summary alone. Without a session
+            # (stateless answers) there is no summary.
+            summary, watermark = "", 0
+            if session_id is not None:
+                summary, watermark = await self.conversation_manager.aget_summary(session_id)
+            unsummarized = [msg for msg in history if msg.get('id', watermark + 1) > watermark]
+            history = self._with_summary(summary, unsummarized)
+            history_counts = self.count_tokens_batch([self._format_message(msg) for msg in history])
+            history_tokens = sum(history_counts)
+            logger.debug("Token budget: %s, history tokens: %d", budget, history_tokens)
+
+            if history_tokens > budget.history:
+                TRUNCATIONS.inc("history_folded")
                 try:
-                    summarized_history = []
-                    current_chunk = []
-                    current_chunk_tokens = 0
-                    chunk_token_limit = max(self.max_tokens // 4, 1)  # Ensure chunk_token_limit is at least 1
-
-                    for msg in reversed(history):
-                        try:
-                            msg_tokens = self.count_tokens(msg['content'])
-                            if current_chunk_tokens + msg_tokens <= chunk_token_limit:
-                                current_chunk.insert(0, msg)
-                                current_chunk_tokens += msg_tokens
-                            else:
-                                if current_chunk:
-                                    chunk_text = "\n".join([f"{m['role']}: {m['content']}" for m in current_chunk])
-                                    summary = await self.summarize_conversation_chunk(chunk_text)
-                                    summarized_history.insert(0, {"role": "system", "content": f"Summary: {summary}"})
-                                current_chunk = [msg]
-                                current_chunk_tokens = msg_tokens
-                        except Exception as e:
-                            logger.error(f"Error processing message in history: {e}")
-                            continue
-
-                    if current_chunk:
-                        summarized_history = current_chunk + summarized_history
-
-                    history = summarized_history
-                    history_tokens = [self.count_tokens(msg['content']) for msg in history]
-                    total_tokens = context_tokens + query_tokens + sum(history_tokens)
+                    counts = history_counts[1:] if summary else history_counts
+                    summary, kept = await self.fold_history(session_id, summary, unsummarized, counts, budget.history)
+                    history = self._with_summary(summary, kept)
+                    history_counts = self.count_tokens_batch([self._format_message(msg) for msg in history])
                 except Exception as e:
                     logger.error(f"Error during history summarization: {e}")
-                    # If summarization fails, we'll return the original history
-                    logger.warning("Returning original history due to summarization failure")
+                    logger.warning("Keeping the newest messages that fit due to summarization failure")
+                # A single oversized message or summary can still overflow; drop the oldest entries that do not fit
+                kept, history_tokens = fit_history(history, history_counts, budget.history)
+                if len(kept) < len(history):
+                    TRUNCATIONS.inc("history_dropped")
+                history = kept
+
+            context_budget = budget.context + (budget.history - history_tokens)
+            context, context_tokens = build_context(docs, context_budget, self.count_tokens, Config.MAX_DOC_TOKENS,
+                                                   count_tokens_batch=self.count_tokens_batch)
 
-            logger.info(f"Final total tokens after truncation and summarization: {total_tokens}")
+            total_tokens = budget.template + budget.query + history_tokens + context_tokens
+            logger.debug("Final total tokens after truncation and summarization: %d", total_tokens)
             return context, history
 
         except Exception as e:
             logger.critical(f"Unhandled error in truncate_context: {e}")
-            # In case of a critical error, return the original context and history
+            # In case of a critical error, return whatever context was built and the original history
             return context, history
 
-    async def process_query(self, query: str, template: str, session_id: str = "default") -> str:
-        try:
-            logger.info(f"Processing query: {query}")
-            # Keep retrieval small to avoid huge prompts on large documents
-            docs = self.retriever.retrieve(query, top_k=5)
-            logger.debug(f"Retrieved {len(docs)} documents matching user query: {query}")
-            # Truncate each doc content to avoid oversized prompts
-            MAX_DOC_CHARS = 1500
-            context = "\n".join([
-                f"Document {i + 1} ({doc.get('source','unknown')}): {doc.get('content','')[:MAX_DOC_CHARS]}"
-                for i, doc in enumerate(docs)
-            ])
+    async def _retrieve(self, query: str):
+        # Keep retrieval small to avoid huge prompts on large documents; with reranking, over-fetch and let the
+        # reranker pick a smaller, more diverse set
+        if self.reranker is None:
+            with STAGE_SECONDS.time("retrieve"):
+                docs = await self.retriever.aretrieve(query, top_k=5)
+        else:
+            with STAGE_SECONDS.time("retrieve"):
+                candidates = await self.retriever.aretrieve(query, top_k=Config.RERANK_CANDIDATES)
+            with STAGE_SECONDS.time("rerank"):
+                docs = await asyncio.to_thread(self.reranker.rerank, query, candidates, Config.RERANK_TOP_K)
+        logger.debug("Retrieved %d documents matching user query: %s", len(docs), query)
+        return docs
+
+    async def _prepare_prompt(self, query: str, template: str, session_id: str) -> PreparedQuery:
+        """
+        Retrieve context, persist the user message and build the final prompt. Queries from sessions without prior
+        history are looked up in the answer cache first, when it is enabled.
+        """
+        docs = await self._retrieve(query)
 
-            self.conversation_manager.add_message("user", query, session_id=session_id)
+        self.conversation_manager.add_message("user", query, session_id=session_id)
 
-            recent_history = self.conversation_manager.get_recent_messages(self.max_history, session_id=session_id)
+        recent_history = await self.conversation_manager.aget_recent_messages(self.max_history, session_id=session_id)
 
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug("Recent persisted conversation history:")
             for msg in recent_history:
-                logger.debug(f"  {msg['role']}: {msg['content'][:50]}...")
+                logger.debug("  %s: %s...", msg['role'], msg['content'][:50])
+
+        cache_key, cached_answer = await self._lookup_answer(docs, query, recent_history, template)
+        if cached_answer is not None:
+            return PreparedQuery(prompt=None, answer=cached_answer, cached=True)
+
+        return await self._build_prompt(docs, query, recent_history, session_id, template, cache_key)
+
+    async def _lookup_answer(self, docs, query, history, template) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Look query up in the answer cache when history holds only the user message just added, so the answer depends on
+        nothing but the query and retrieved documents.
 
-            truncated_context, truncated_history = await self.truncate_context(context, query, recent_history)
+        :return: (cache_key, cached_answer); cache_key is None when the answer must not be cached
+        """
+        if self.answer_cache is None or len(history) > 1:
+            return None, None
+        cache_key = AnswerCache.make_key(template, query, docs, self.prompt_node.model_name)
+        cached_answer = await self.answer_cache.aget(cache_key)
+        if cached_answer is not None:
+            logger.info("Answer cache hit")
+        return cache_key, cached_answer
 
-            logger.debug(f"Truncated context length: {len(truncated_context)}")
-            logger.debug(f"Truncated history length: {len(truncated_history)}")
+    async def _build_prompt(self, docs, query, history, session_id, template, cache_key=None) -> PreparedQuery:
+        with STAGE_SECONDS.time("truncate_context"):
+            truncated_context, truncated_history = await self.truncate_context(docs, query, history, session_id,
+                                                                               template)
 
-            logger.debug(f"Truncated conversation history:")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Truncated context length: %d", len(truncated_context))
+            logger.debug("Truncated history length: %d", len(truncated_history))
+            logger.debug("Truncated conversation history:")
             for msg in truncated_history:
-                logger.debug(f"  {msg['role']}: {msg['content'][:50]}...")  # Log first 50 chars of each message
+                logger.debug("  %s: %s...", msg['role'], msg['content'][:50])  # Log first 50 chars of each message
 
+        with STAGE_SECONDS.time("prompt_build"):
             prompt = get_prompt(template, truncated_context, query, truncated_history)
-
             final_token_count = self.count_tokens(prompt)
-            logger.debug(f"Final prompt token count: {final_token_count}")
+        logger.debug("Final prompt token count: %d", final_token_count)
 
-            if final_token_count > self.max_tokens:
-                logger.warning(f"Final prompt exceeds max tokens: {final_token_count} > {self.max_tokens}")
-                return "I apologize, but the current query with context is too long for me to process. Could you please try a shorter query or provide less context?"
+        if final_token_count > self.max_tokens:
+            logger.warning(f"Final prompt exceeds max tokens: {final_token_count} > {self.max_tokens}")
+            TRUNCATIONS.inc("prompt_too_long")
+            return PreparedQuery(prompt=None, answer="I apologize, but the current query with context is too long for me to process. Could you please try a shorter query or provide less context?")
 
-            response = await self.prompt_node.prompt(prompt)
-            self.conversation_manager.add_message("assistant", response, session_id=session_id)
-            logger.info("Query processed successfully")
-            return response
+        return PreparedQuery(prompt=prompt, cache_key=cache_key)
 
-        except Exception as e:
-            logger.critical(f"Unhandled error in process_query: {e}", exc_info=True)
-            return "I'm sorry, but I encountered an unexpected error. Please try again or contact support if the issue persists."
+    async def is_stateless(self, session_id: str) -> bool:
+        """True if the session has no history yet, so its next answer depends only on the query."""
+        return not await self.conversation_manager.aget_recent_messages(1, session_id=session_id)
+
+    async def answer_stateless(self, query: str, template: str) -> Tuple[str, bool]:
+        """
+        Answer query as the first turn of a conversation without reading or writing any session's history, so
+        concurrent identical first questions can share one computation. Callers record the exchange themselves.
+
+        :return: (answer, save) where save is False for error and "too long" messages, which process_query() does not
+                 persist either
+        """
+        with QUERIES_IN_FLIGHT.track(), STAGE_SECONDS.time("stateless_query"):
+            try:
+                docs = await self._retrieve(query)
+                # Same history a fresh session would have: just the user message
+                history = [{'role': 'user', 'content': query}]
+                answer, save = await self._generate(docs, query, history, None, template)
+                logger.info("Stateless query processed successfully")
+                return answer, save
+
+            except Exception as e:
+                logger.critical(f"Unhandled error in answer_stateless: {e}", exc_info=True)
+                return "I'm sorry, but I encountered an unexpected error. Please try again or contact support if the issue persists.", False
+
+    async def _generate(self, docs, query, history, session_id, template, limiter=None) -> Tuple[str, bool]:
+        """
+        Answer query from already retrieved docs and a history ending with the user message, consulting the answer
+        cache when that message is the whole history. limiter, if given, is held around the LLM call only.
+
+        :return: (answer, save) as for answer_stateless()
+        """
+        cache_key, cached_answer = await self._lookup_answer(docs, query, history, template)
+        if cached_answer is not None:
+            return cached_answer, True
+
+        prepared = await self._build_prompt(docs, query, history, session_id, template, cache_key)
+        if prepared.prompt is None:
+            return prepared.answer, False
+
+        if limiter is None:
+            response = await self.prompt_node.prompt(prepared.prompt)
+        else:
+            async with limiter:
+                response = await self.prompt_node.prompt(prepared.prompt)
+        if cache_key is not None:
+            await self.answer_cache.aset(cache_key, response)
+        return response, True
+
+    async def process_batch(self, items: List[Tuple[str, Optional[str]]], template: str = "default",
+                            concurrency: int = 8, limiter: Any = None,
+                            session_lock: Optional[Callable[[str], AsyncContextManager]] = None
+                            ) -> AsyncIterator[Tuple[int, str]]:
+        """
+        Answer many (query, session_id) items, yielding (index, answer) pairs as they finish rather than in input
+        order.
+
+        Items sharing a session_id are answered in input order, each seeing the earlier ones in its history. Items
+        without a session_id are answered statelessly and not recorded, and identical ones share one answer. Duplicate
+        queries share one retrieval. Each session's history is written in a single write once its items are done (also
+        when the caller stops early).
+
+        :param concurrency: LLM calls this batch runs at once, when no limiter is given
+        :param limiter: Async context manager held around each LLM call, typically shared by all batches
+        :param session_lock: Returns an async context manager held while a session's items are answered, so they do
+                             not interleave with other requests for the same session
+        """
+        limiter = limiter or asyncio.Semaphore(max(concurrency, 1))
+        retrievals: Dict[str, asyncio.Future] = {}
+        stateless: Dict[str, asyncio.Future] = {}
+        sessions: Dict[str, List[Tuple[int, str]]] = {}
+        results: asyncio.Queue = asyncio.Queue()
+        error = "I'm sorry, but I encountered an unexpected error. Please try again or contact support if the issue persists."
+
+        def shared(memo, key, make):
+            # Duplicates await the first one's task; shield keeps one cancelled waiter from cancelling it for all
+            if key not in memo:
+                memo[key] = asyncio.ensure_future(make())
+            return asyncio.shield(memo[key])
+
+        async def answer_stateless(index, query):
+            async def compute():
+                docs = await shared(retrievals, normalize_query(query), lambda: self._retrieve(query))
+                return await self._generate(docs, query, [{'role': 'user', 'content': query}], None, template, limiter)
+            try:
+                answer, _ = await shared(stateless, normalize_query(query), compute)
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {e}", exc_info=True)
+                answer = error
+            results.put_nowait((index, answer))
+
+        async def answer_session(session_id, session_items):
+            pending = list(session_items)
+            try:
+                async with session_lock(session_id) if session_lock else contextlib.nullcontext():
+                    await answer_session_items(session_id, pending)
+            except Exception as e:
+                logger.error(f"Batch items for session {session_id} failed: {e}")
+                for index, _ in pending:
+                    results.put_nowait((index, error))
+
+        async def answer_session_items(session_id, pending):
+            rows: List[Tuple[str, str, str]] = []
+            try:
+                try:
+                    history = await self.conversation_manager.aget_recent_messages(self.max_history,
+                                                                                   session_id=session_id)
+                except Exception as e:
+                    logger.error(f"Could not load history for session {session_id}: {e}")
+                    history = []
+                while pending:
+                    index, query = pending[0]
+                    history.append({'role': 'user', 'content': query})
+                    rows.append(("user", query, session_id))
+                    try:
+                        docs = await shared(retrievals, normalize_query(query), lambda: self._retrieve(query))
+                        answer, save = await self._generate(docs, query, history[-self.max_history:], session_id,
+                                                            template, limiter)
+                    except Exception as e:
+                        logger.error(f"Batch item {index} failed: {e}", exc_info=True)
+                        answer, save = error, False
+                    if save:
+                        history.append({'role': 'assistant', 'content': answer})
+                        rows.append(("assistant", answer, session_id))
+                    pending.pop(0)
+                    results.put_nowait((index, answer))
+            finally:
+                # Written while the session is still held, so the next request for it sees these messages
+                self.conversation_manager.add_messages(rows)
+
+        tasks = []
+        for index, (query, session_id) in enumerate(items):
+            if session_id is None:
+                tasks.append(asyncio.ensure_future(answer_stateless(index, query)))
+            else:
+                sessions.setdefault(session_id, []).append((index, query))
+        tasks.extend(asyncio.ensure_future(answer_session(sid, its)) for sid, its in sessions.items())
+        logger.info(f"Processing batch of {len(items)} queries ({len(sessions)} sessions, "
+                    f"{len(set(normalize_query(q) for q, _ in items))} distinct queries)")
+
+        try:
+            for _ in range(len(items)):
+                yield await results.get()
+        finally:
+            for task in [*tasks, *retrievals.values(), *stateless.values()]:
+                task.cancel()
+
+    async def process_query(self, query: str, template: str, session_id: str = "default") -> str:
+        with QUERIES_IN_FLIGHT.track(), STAGE_SECONDS.time("query"):
+            try:
+                logger.info("Processing query: %s", query)
+                prepared = await self._prepare_prompt(query, template, session_id)
+                if prepared.prompt is None:
+                    if prepared.cached:
+                        self.conversation_manager.add_message("assistant", prepared.answer, session_id=session_id)
+                    return prepared.answer
+
+                response = await self.prompt_node.prompt(prepared.prompt)
+                self.conversation_manager.add_message("assistant", response, session_id=session_id)
+                if prepared.cache_key is not None:
+                    await self.answer_cache.aset(prepared.cache_key, response)
+                logger.info("Query processed successfully")
+                return response
+
+            except Exception as e:
+                logger.critical(f"Unhandled error in process_query: {e}", exc_info=True)
+                return "I'm sorry, but I encountered an unexpected error. Please try again or contact support if the issue persists."
+
+    async def process_query_stream(self, query: str, template: str, session_id: str = "default") -> AsyncIterator[str]:
+        """
+        Streaming variant of process_query(): yields answer deltas as the LLM produces them and persists the full
+        assistant message once the stream has finished.
+        """
+        parts = []
+        with QUERIES_IN_FLIGHT.track(), STAGE_SECONDS.time("stream_query"):
+            try:
+                logger.info("Processing streaming query: %s", query)
+                prepared = await self._prepare_prompt(query, template, session_id)
+                if prepared.prompt is None:
+                    if prepared.cached:
+                        self.conversation_manager.add_message("assistant", prepared.answer, session_id=session_id)
+                    yield prepared.answer
+                    return
+
+                async for delta in self.prompt_node.prompt_stream(prepared.prompt):
+                    parts.append(delta)
+                    yield delta
+
+                response = "".join(parts)
+                self.conversation_manager.add_message("assistant", response, session_id=session_id)
+                if prepared.cache_key is not None:
+                    await self.answer_cache.aset(prepared.cache_key, response)
+                logger.info("Streaming query processed successfully")
+
+            except Exception as e:
+                logger.critical(f"Unhandled error in process_query_stream: {e}", exc_info=True)
+                if parts:
+                    # Keep what the user already saw so the next turn has consistent history
+                    self.conversation_manager.add_message("assistant", "".join(parts), session_id=session_id)
+                yield "I'm sorry, but I encountered an unexpected error. Please try again or contact support if the issue persists."
@@ -1,13 +1,19 @@
+import json
 import logging
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
 
 from fastapi import FastAPI, Header, HTTPException, status, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import asyncio
 
+import metrics
 from RAG_pipeline import RAGPipeline
+from cache import normalize_query
 from config import Config
+from logging_config import setup_logging, shutdown_logging
+from scheduler import GenerationScheduler, Rejected
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +23,15 @@ class ChatRequest(BaseModel):
     template: Optional[str] = "default"
     session_id: Optional[str] = "default"
 
+class BatchItem(BaseModel):
+    query: str
+    # Items without a session are answered statelessly and not recorded in any history
+    session_id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    template: Optional[str] = "default"
+
 class ClearRequest(BaseModel):
     session_id: Optional[str] = None
 
@@ -24,6 +39,34 @@ class ChatResponse(BaseModel):
     answer: str
 
 
+class SingleFlight:
+    """
+    Coalesce concurrent calls by key: the first caller starts the computation and later callers with the same key
+    await the same result instead of starting their own. The computation runs as its own task, so a caller that
+    disconnects does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
 def create_app() -> FastAPI:
     app = FastAPI(title="RAG Assistant API", version="0.1.0")
 
@@ -45,20 +88,99 @@ def create_app() -> FastAPI:
     )
 
     rag = RAGPipeline()
+    # Identical first questions in flight at the same time share one retrieval and generation
+    single_flight = SingleFlight()
+    # Bounds concurrent generations against the LLM backend and turns away requests it cannot queue
+    scheduler = GenerationScheduler(
+        max_concurrent=Config.MAX_CONCURRENT_GENERATIONS,
+        max_queue=Config.GENERATION_QUEUE_SIZE,
+        queue_timeout=Config.GENERATION_QUEUE_TIMEOUT,
+        retry_after=Config.GENERATION_RETRY_AFTER,
+    )
+
+    # LLM calls of all /api/chat/batch requests together, on top of the scheduler's interactive generations
+    batch_limiter = asyncio.Semaphore(max(Config.BATCH_CONCURRENCY, 1))
+
+    metrics.set_enabled(Config.METRICS_ENABLED)
+
+    def collect_state():
+        # Scrape-time view of counters the scheduler, single-flight, LLM pool and caches already keep
+        stats = scheduler.stats()
+        yield "rag_generations_running", "gauge", "Generations holding a scheduler slot", [({}, stats["running"])]
+        yield "rag_generations_queued", "gauge", "Requests waiting for a generation slot", [({}, stats["queued"])]
+        yield "rag_session_queued", "gauge", "Requests waiting for an earlier request of their session", [
+            ({}, stats["session_queued"])
+        ]
+        yield "rag_generations_admitted_total", "counter", "Requests admitted by the scheduler", [({}, stats["admitted"])]
+        yield "rag_generations_rejected_total", "counter", "Requests turned away by the scheduler", [
+            ({"reason": "queue_full"}, stats["rejected_queue_full"]),
+            ({"reason": "session_busy"}, stats["rejected_session_busy"]),
+            ({"reason": "timeout"}, stats["timeouts"]),
+        ]
+        yield "rag_single_flight_total", "counter", "Stateless /api/chat requests that started or joined a computation", [
+            ({"outcome": "started"}, single_flight.started),
+            ({"outcome": "coalesced"}, single_flight.coalesced),
+        ]
+        if rag.prompt_node is not None:
+            backends = rag.prompt_node.pool.stats()
+            yield "rag_llm_backend_outstanding", "gauge", "Requests in flight per LLM backend", [
+                ({"backend": b["url"]}, b["outstanding"]) for b in backends
+            ]
+            yield "rag_llm_backend_healthy", "gauge", "1 if the LLM backend is in rotation", [
+                ({"backend": b["url"]}, int(b["healthy"])) for b in backends
+            ]
+        caches = {"summary": rag.summary_cache}
+        if rag.retriever is not None and rag.retriever.cache is not None:
+            caches["retrieval"] = rag.retriever.cache
+        if rag.answer_cache is not None:
+            caches["answer"] = rag.answer_cache.memory
+        cache_stats = {name: cache.stats() for name, cache in caches.items()}
+        for key in ("hits", "misses", "evictions"):
+            yield f"rag_cache_{key}_total", "counter", f"Cache {key} by cache", [
+                ({"cache": name}, stats[key]) for name, stats in cache_stats.items()
+            ]
+        yield "rag_cache_entries", "gauge", "Entries held by cache", [
+            ({"cache": name}, stats["entries"]) for name, stats in cache_stats.items()
+        ]
+
+    def rejection(e: Rejected) -> HTTPException:
+        return HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
 
     @app.on_event("startup")
-    def startup_event():
+    async def startup_event():
         # Initialize logging here too just in case API runs standalone
+        setup_logging()
         try:
             rag.initialize()
+            await rag.start()
             logger.info("RAG pipeline initialized for API server")
         except Exception as e:
-            logger.exception(f"Failed to initialize RAG pipeline: {e}")
+            logger.exception("Failed to initialize RAG pipeline: %s", e)
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        await rag.shutdown()
+        shutdown_logging()
 
     @app.get("/health")
     def health():
         # Minimal health signal; deeper checks could be added
-        return {"status": "ok", "weaviate_url": Config.WEAVIATE_URL, "model": Config.JANAI_MODEL_NAME}
+        return {
+            "status": "ok",
+            "weaviate_url": Config.WEAVIATE_URL,
+            "model": Config.JANAI_MODEL_NAME,
+            "scheduler": scheduler.stats(),
+            "llm_backends": rag.prompt_node.pool.stats() if rag.prompt_node else [],
+        }
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics_endpoint():
+        if not Config.METRICS_ENABLED:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+        return PlainTextResponse(
+            metrics.REGISTRY.render(collectors=[collect_state]),
+            media_type="text/plain; version=0.0.4; charset=utf-8",
+        )
 
     def require_api_key(x_api_key: Optional[str] = Header(default=None)):
         # If ALLOWED_API_KEYS is configured, enforce header check
@@ -72,8 +194,75 @@ def create_app() -> FastAPI:
 
     @app.post("/api/chat", response_model=ChatResponse)
     async def chat(req: ChatRequest, _: bool = Depends(require_api_key)):
-        answer = await rag.process_query(req.query, req.template, session_id=req.session_id or "default")
-        return ChatResponse(answer=answer)
+        session_id = req.session_id or "default"
+        try:
+            async with scheduler.session(session_id):
+                if Config.SINGLE_FLIGHT_ENABLED and await rag.is_stateless(session_id):
+                    # Only the shared computation takes a generation slot; callers joining it just wait. Each caller
+                    # keeps its own history, recorded once the answer is in so a rejected request leaves none.
+                    key = (req.template, normalize_query(req.query))
+                    answer, save = await single_flight.run(
+                        key, lambda: scheduler.run(lambda: rag.answer_stateless(req.query, req.template))
+                    )
+                    rag.conversation_manager.add_message("user", req.query, session_id=session_id)
+                    if save:
+                        rag.conversation_manager.add_message("assistant", answer, session_id=session_id)
+                    return ChatResponse(answer=answer)
+                answer = await scheduler.run(
+                    lambda: rag.process_query(req.query, req.template, session_id=session_id)
+                )
+                return ChatResponse(answer=answer)
+        except Rejected as e:
+            raise rejection(e)
+
+    @app.post("/api/chat/stream")
+    async def chat_stream(req: ChatRequest, _: bool = Depends(require_api_key)):
+        session_id = req.session_id or "default"
+        # Reject up front while a status code can still be sent; the slot itself is taken once the stream starts
+        try:
+            scheduler.check(session_id)
+        except Rejected as e:
+            raise rejection(e)
+
+        # Server-Sent Events: one {"delta": ...} event per chunk, terminated by [DONE] like OpenAI-compatible APIs
+        async def event_stream():
+            try:
+                async with scheduler.session(session_id), scheduler.slot():
+                    async for delta in rag.process_query_stream(req.query, req.template, session_id=session_id):
+                        yield f"data: {json.dumps({'delta': delta})}\n\n"
+            except Rejected as e:
+                yield f"data: {json.dumps({'error': e.detail, 'retry_after': e.retry_after})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.post("/api/chat/batch")
+    async def chat_batch(req: BatchRequest, _: bool = Depends(require_api_key)):
+        if len(req.items) > Config.BATCH_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"At most {Config.BATCH_MAX_ITEMS} items per batch",
+            )
+
+        # NDJSON: one {"index", "session_id", "answer"} line per item in completion order, then a final {"done"} line
+        async def result_lines():
+            count = 0
+            results = rag.process_batch(
+                [(item.query, item.session_id) for item in req.items],
+                req.template,
+                limiter=batch_limiter,
+                session_lock=scheduler.session,
+            )
+            async for index, answer in results:
+                count += 1
+                yield json.dumps({"index": index, "session_id": req.items[index].session_id, "answer": answer}) + "\n"
+            yield json.dumps({"done": True, "count": count}) + "\n"
+
+        return StreamingResponse(result_lines(), media_type="application/x-ndjson")
 
     @app.post("/api/clear")
     def clear(req: ClearRequest, _: bool = Depends(require_api_key)):
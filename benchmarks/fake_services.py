@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import re
+import socket
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# Make the application modules at the repo root importable when run as `python benchmarks/fake_services.py`
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from bm25_index import DEFAULT_B, DEFAULT_K1, tokenize
+from chunking import chunk_document
+from embeddings import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+# fake_services.py: Local stand-ins for the services the assistant talks to, so benchmarks run without Docker, models
+# or network access and give the same numbers on every run:
+#   - FakeWeaviate answers the GraphQL BM25 queries WeaviateRetriever sends, from fixture passages held in memory
+#   - FakeLLM is an OpenAI-compatible /v1/chat/completions endpoint with configurable latency and token rate, in both
+#     streaming and non-streaming mode
+# Run this file directly to serve both for manual testing against api_server.py.
+
+_GRAPHQL_GET = re.compile(r"\{Get\{(\w+)\((.*)\)\{([^{}]*)\}\}\}", re.S)
+_GRAPHQL_LIMIT = re.compile(r"limit:\s*(\d+)")
+_GRAPHQL_BM25 = re.compile(r'bm25:\s*\{query:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def synthetic_passages(count: int = 2000, words_per_passage: int = 150, vocabulary: int = 5000,
+                       seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Deterministic fixture corpus: passages of pseudo-words drawn from a Zipf-like distribution, so a few terms are
+    common and most are rare, as in real text.
+    """
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "do", "fi", "gu", "he", "ju", "be"]
+    words = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(vocabulary * 2)})
+    words = words[:vocabulary]
+    rng.shuffle(words)
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    passages = []
+    for i in range(count):
+        text = " ".join(rng.choices(words, weights=weights, k=words_per_passage))
+        passages.append({
+            "content": text,
+            "source": f"doc{i // 4:05d}.txt",
+            "chunk_index": i % 4,
+            "start_offset": 0,
+            "end_offset": len(text),
+        })
+    return passages
+
+
+def load_passages(documents_dir: str, max_chars: int = 1500, overlap_chars: int = 200) -> List[Dict[str, Any]]:
+    """Chunk the .txt/.md files of a directory the way the ingestion script does."""
+    passages = []
+    for path in sorted(Path(documents_dir).rglob("*")):
+        if path.suffix.lower() not in (".txt", ".md") or not path.is_file():
+            continue
+        document = {"content": path.read_text(encoding="utf-8", errors="replace"),
+                    "source": path.relative_to(documents_dir).as_posix()}
+        passages.extend(chunk_document(document, max_chars, overlap_chars))
+    return passages
+
+
+def sample_queries(passages: List[Dict[str, Any]], count: int, seed: int = 0, min_terms: int = 3,
+                   max_terms: int = 6) -> List[str]:
+    """Queries made of a few words taken from random passages, so every query has matches."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = [w for w in tokenize(rng.choice(passages)["content"]) if w not in STOPWORDS] or ["document"]
+        start = rng.randrange(len(words))
+        queries.append(" ".join(words[start:start + rng.randint(min_terms, max_terms)]))
+    return queries
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_app(app: web.Application, host: str = "127.0.0.1", port: Optional[int] = None) -> Tuple[web.AppRunner, str]:
+    """Serve app on the running loop; returns the runner (for cleanup()) and the base URL."""
+    port = port or free_port()
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner, f"http://{host}:{port}"
+
+
+class FakeWeaviate:
+    """
+    Serves the endpoints weaviate.Client touches at startup (ready, meta, OIDC discovery) and GraphQL Get queries with
+    a bm25 argument, scored with the same BM25 formula as the local index. Queries without bm25 (near_vector, where
+    filters for neighbour expansion) return no passages.
+
+    :param passages: Passages with the PASSAGE_PROPERTIES fields
+    :param latency: Seconds added to every GraphQL response
+    """
+
+    def __init__(self, passages: List[Dict[str, Any]], latency: float = 0.0):
+        self.passages = passages
+        self.latency = latency
+        self.queries = 0
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths = []
+        for doc_id, passage in enumerate(passages):
+            terms = Counter(tokenize(passage.get("content") or ""))
+            self._lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, []).append((doc_id, tf))
+        self._avg_length = sum(self._lengths) / max(len(self._lengths), 1)
+
+    def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        scores: Dict[int, float] = {}
+        n = len(self.passages)
+        for term in set(tokenize(query)) - STOPWORDS:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                norm = DEFAULT_K1 * (1 - DEFAULT_B + DEFAULT_B * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (DEFAULT_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+        return [self.passages[doc_id] for doc_id, _ in ranked]
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/.well-known/ready", self._ok)
+        app.router.add_get("/v1/.well-known/live", self._ok)
+        app.router.add_get("/v1/.well-known/openid-configuration", self._not_found)
+        app.router.add_get("/v1/meta", self._meta)
+        app.router.add_post("/v1/graphql", self._graphql)
+        return app
+
+    async def _ok(self, request: web.Request) -> web.Response:
+        return web.Response(status=200)
+
+    async def _not_found(self, request: web.Request) -> web.Response:
+        return web.Response(status=404)
+
+    async def _meta(self, request: web.Request) -> web.Response:
+        return web.json_response({"hostname": "http://[::]:8080", "modules": {}, "version": "1.24.0"})
+
+    async def _graphql(self, request: web.Request) -> web.Response:
+        self.queries += 1
+        body = await request.json()
+        match = _GRAPHQL_GET.search(body.get("query", ""))
+        if match is None:
+            return web.json_response({"errors": [{"message": "unsupported query"}]})
+        class_name, arguments, fields = match.groups()
+        limit = _GRAPHQL_LIMIT.search(arguments)
+        bm25 = _GRAPHQL_BM25.search(arguments)
+        results = []
+        if bm25 is not None:
+            query = bm25.group(1).replace('\\"', '"')
+            results = self.search(query, int(limit.group(1)) if limit else 10)
+        properties = fields.split()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response(
+            {"data": {"Get": {class_name: [{p: passage.get(p) for p in properties} for passage in results]}}}
+        )
+
+
+class FakeLLM:
+    """
+    OpenAI-compatible chat completions endpoint. Each response waits `latency` seconds (time to first token), then
+    produces `output_tokens` tokens at `tokens_per_second`: streamed as SSE deltas when the request asks for stream,
+    otherwise returned in one JSON body once all tokens are "generated". `max_concurrency` models the server's batch
+    slots; requests beyond it wait, as they would on llama.cpp with a fixed number of slots.
+    """
+
+    def __init__(self, latency: float = 0.2, tokens_per_second: float = 50.0, output_tokens: int = 64,
+                 max_concurrency: int = 0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.requests = 0
+        self.prompt_chars = 0
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._completions)
+        return app
+
+    def _tokens(self, prompt: str) -> List[str]:
+        # Echo a few prompt words so answers differ per query, as real ones would
+        words = prompt.split()[-8:] or ["ok"]
+        return [words[i % len(words)] + " " for i in range(self.output_tokens)]
+
+    async def _completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        self.requests += 1
+        self.prompt_chars += len(prompt)
+        if self._slots is None:
+            return await self._respond(request, body, prompt)
+        async with self._slots:
+            return await self._respond(request, body, prompt)
+
+    async def _respond(self, request: web.Request, body: Dict[str, Any], prompt: str) -> web.StreamResponse:
+        tokens = self._tokens(prompt)
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        await asyncio.sleep(self.latency)
+        if not body.get("stream"):
+            await asyncio.sleep(interval * len(tokens))
+            return web.json_response({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(tokens)},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        start = time.monotonic()
+        for i, token in enumerate(tokens):
+            # Pace against the start time so sleep overshoot does not accumulate
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            chunk = {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+async def serve(args):
+    passages = load_passages(args.documents_dir) if args.documents_dir else synthetic_passages(args.passages, seed=args.seed)
+    weaviate_runner, weaviate_url = await start_app(FakeWeaviate(passages, args.weaviate_latency).app(),
+                                                    args.host, args.weaviate_port)
+    llm = FakeLLM(args.llm_latency, args.llm_tokens_per_second, args.llm_output_tokens, args.llm_max_concurrency)
+    llm_runner, llm_url = await start_app(llm.app(), args.host, args.llm_port)
+    logger.info(f"Fake Weaviate with {len(passages)} passages at {weaviate_url}")
+    logger.info(f"Fake LLM at {llm_url}/v1/chat/completions")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await weaviate_runner.cleanup()
+        await llm_runner.cleanup()
+
+
+def add_service_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--documents-dir", help="Serve passages chunked from this directory instead of synthetic ones")
+    parser.add_argument("--passages", type=int, default=2000, help="Synthetic passages to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus and queries")
+    parser.add_argument("--weaviate-latency", type=float, default=0.0, help="Seconds added to each GraphQL query")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50.0, help="Generation speed of the fake LLM")
+    parser.add_argument("--llm-output-tokens", type=int, default=64, help="Tokens in every fake answer")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0,
+                        help="Requests the fake LLM serves at once (0 for unlimited)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Serve a fake Weaviate and a fake OpenAI-compatible LLM.")
+    add_service_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--weaviate-port", type=int, default=8080)
+    parser.add_argument("--llm-port", type=int, default=1337)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import re
+import secrets
+import sqlite3
+import sys
+import time
+from calendar import timegm
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+
+sys.path.append(str(Path(__file__).resolve().parent))
+from run_benchmark import git_commit, latency_summary
+
+logger = logging.getLogger(__name__)
+
+# replay.py: Capture-and-replay load testing from real conversations.
+#
+#   python benchmarks/replay.py export --db conversations.db --output traces.jsonl
+#   python benchmarks/replay.py replay --traces traces.jsonl --url http://127.0.0.1:8000 --speedup 10
+#
+# export turns the conversations table into one JSON line per session: when it started and, for each user turn, its
+# offset from the session start, the pseudonymized query and how many messages of history preceded it. Session ids are
+# replaced by keyed hashes and, by default (--text pseudo), every word of the query is replaced with a keyed
+# pseudo-word, which keeps lengths and repeats. --text scrub keeps the real wording and only redacts e-mail addresses,
+# URLs, phone-like and other long numbers; names and other personal details stay in, so it is not anonymization.
+#
+# replay sends the traces to a running api_server with open-loop arrival: sessions start at their recorded times
+# divided by --speedup, whether or not earlier requests have finished. Within a session a turn is sent at its recorded
+# time or as soon as the previous answer arrives, whichever is later, since a real user cannot ask before reading. The
+# report gives per-turn latency percentiles for each history-length bucket.
+
+_EMAIL = re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b")
+_URL = re.compile(r"\bhttps?://\S+|\bwww\.\S+", re.I)
+_LONG_NUMBER = re.compile(r"(?<!\w)\+?\d[\d\s().-]{5,}\d(?!\w)")
+# Placeholders left by scrub_text are kept as they are
+_WORD_OR_PLACEHOLDER = re.compile(r"<\w+>|\w+")
+
+DEFAULT_HISTORY_BUCKETS = (0, 2, 6, 10, 20)
+
+
+def scrub_text(text: str) -> str:
+    text = _EMAIL.sub("<email>", text)
+    text = _URL.sub("<url>", text)
+    return _LONG_NUMBER.sub("<number>", text)
+
+
+def pseudonymize_text(text: str, key: bytes) -> str:
+    """Replace every word with a keyed pseudo-word of the same length; equal words stay equal across the export."""
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+
+    def replace(match):
+        word = match.group(0)
+        if word.startswith("<"):
+            return word
+        digest = hmac.new(key, word.casefold().encode("utf-8"), hashlib.sha256).digest()
+        return "".join(alphabet[b % 26] for b in digest[:len(word)]) + "x" * max(len(word) - len(digest), 0)
+
+    return _WORD_OR_PLACEHOLDER.sub(replace, scrub_text(text))
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    # SQLite CURRENT_TIMESTAMP: "YYYY-MM-DD HH:MM:SS" in UTC
+    if not value:
+        return None
+    try:
+        return float(timegm(time.strptime(value[:19], "%Y-%m-%d %H:%M:%S")))
+    except ValueError:
+        return None
+
+
+def export_traces(db_path: str, text_mode: str = "pseudo", key: Optional[bytes] = None,
+                  min_turns: int = 1) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one trace per session in the conversations table, in order of first message. The database is opened
+    read-only and rows are streamed, so exporting a large history does not load it into memory.
+    """
+    key = key or secrets.token_bytes(32)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT c.session_id, c.role, c.content, c.timestamp FROM conversations c "
+            "JOIN (SELECT session_id, MIN(id) AS first_id FROM conversations GROUP BY session_id) f "
+            "ON c.session_id = f.session_id ORDER BY f.first_id, c.id"
+        )
+        session = None
+        trace = None
+        messages = 0
+        for session_id, role, content, timestamp in rows:
+            if session_id != session:
+                if trace is not None and len(trace["turns"]) >= min_turns:
+                    yield trace
+                session = session_id
+                anonymous_id = hmac.new(key, str(session_id).encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+                trace = {"session": anonymous_id, "start": _parse_timestamp(timestamp), "turns": []}
+                messages = 0
+            at = _parse_timestamp(timestamp)
+            if role == "user":
+                query = content or ""
+                query = pseudonymize_text(query, key) if text_mode == "pseudo" else scrub_text(query)
+                offset = at - trace["start"] if at is not None and trace["start"] is not None else 0.0
+                trace["turns"].append({"offset": offset, "query": query, "history_messages": messages})
+            elif role == "assistant" and trace["turns"]:
+                trace["turns"][-1]["answer_chars"] = len(content or "")
+            messages += 1
+        if trace is not None and len(trace["turns"]) >= min_turns:
+            yield trace
+    finally:
+        conn.close()
+
+
+def history_bucket(history_messages: int, buckets) -> str:
+    """Label of the bucket history_messages falls in, e.g. "0-1", "2-5" or "20+" for buckets (0, 2, 6, 20)."""
+    for low, high in zip(buckets, list(buckets[1:]) + [None]):
+        if high is None or history_messages < high:
+            if high is None:
+                return f"{low}+"
+            return str(low) if high - low == 1 else f"{low}-{high - 1}"
+    return str(history_messages)
+
+
+async def replay(traces: List[Dict[str, Any]], base_url: str, speedup: float = 1.0, template: str = "default",
+                 api_key: Optional[str] = None, timeout: float = 300.0, buckets=DEFAULT_HISTORY_BUCKETS,
+                 max_gap: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Replay traces against base_url/api/chat and return the report. max_gap caps the recorded idle time between
+    sessions and between turns (after scaling), so overnight lulls do not stretch the run.
+    """
+    run_id = secrets.token_hex(4)
+    origin = min((t["start"] for t in traces if t.get("start") is not None), default=0.0)
+    url = base_url.rstrip("/") + "/api/chat"
+    headers = {"X-API-Key": api_key} if api_key else {}
+    samples: List[Dict[str, Any]] = []
+
+    # Session start times relative to the first one, scaled and with long idle gaps cut
+    starts = []
+    clock = 0.0
+    previous = None
+    for trace in sorted(traces, key=lambda t: t.get("start") or origin):
+        recorded = ((trace.get("start") or origin) - origin) / speedup
+        gap = recorded - previous if previous is not None else recorded
+        clock += min(gap, max_gap) if max_gap is not None else gap
+        previous = recorded
+        starts.append((clock, trace))
+
+    async def run_session(session, begin, start_at, trace):
+        session_id = f"replay-{run_id}-{trace['session']}"
+        last_offset = 0.0
+        due = start_at
+        answered = begin
+        for turn in trace["turns"]:
+            gap = (turn.get("offset", 0.0) - last_offset) / speedup
+            last_offset = turn.get("offset", 0.0)
+            due += min(gap, max_gap) if max_gap is not None else gap
+            # Recorded time, but never before the previous answer
+            delay = max(begin + due, answered) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent = time.monotonic()
+            status = None
+            try:
+                async with session.post(url, json={"query": turn["query"], "template": template,
+                                                   "session_id": session_id}) as response:
+                    status = response.status
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.debug(f"Request failed: {e}")
+            answered = done = time.monotonic()
+            samples.append({
+                "history_messages": turn.get("history_messages", 0),
+                "status": status,
+                "latency": done - sent,
+                "lateness": max(sent - (begin + due), 0.0),
+            })
+
+    connector = aiohttp.TCPConnector(limit=0)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, headers=headers, timeout=client_timeout) as session:
+        begin = time.monotonic()
+        await asyncio.gather(*[run_session(session, begin, start_at, trace) for start_at, trace in starts])
+        duration = time.monotonic() - begin
+
+    by_bucket: Dict[str, List[Dict[str, Any]]] = {}
+    for sample in samples:
+        by_bucket.setdefault(history_bucket(sample["history_messages"], buckets), []).append(sample)
+    bucket_order = [history_bucket(low, buckets) for low in buckets]
+
+    def summarize(group):
+        ok = [s["latency"] for s in group if s["status"] == 200]
+        return {
+            "requests": len(group),
+            "ok": len(ok),
+            "statuses": dict(Counter(str(s["status"]) for s in group)),
+            "latency_ms": latency_summary(ok),
+        }
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "url": base_url,
+        "speedup": speedup,
+        "max_gap": max_gap,
+        "sessions": len(traces),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(samples) / duration, 2) if duration else 0.0,
+        "overall": summarize(samples),
+        # Requests sent later than scheduled because their session was still waiting for an answer
+        "send_lateness_ms": latency_summary([s["lateness"] for s in samples]),
+        "by_history_messages": {b: summarize(by_bucket[b]) for b in bucket_order if b in by_bucket},
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{report['sessions']} sessions, {report['overall']['requests']} requests in {report['duration_s']}s "
+          f"({report['throughput_rps']} req/s), statuses {report['overall']['statuses']}")
+    print(f"{'history':<10}{'reqs':>7}{'ok':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(report["by_history_messages"].items()) + [("all", report["overall"])]
+    for bucket, stats in rows:
+        lat = stats["latency_ms"]
+        print(f"{bucket:<10}{stats['requests']:>7}{stats['ok']:>7}{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export conversation traces and replay them against the API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export",
+                                 help="Write pseudonymized session traces from conversations.db as JSON lines")
+    export.add_argument("--db", default="conversations.db", help="Conversation database to read")
+    export.add_argument("--output", required=True, help="JSON lines file to write")
+    export.add_argument("--text", choices=["pseudo", "scrub"], default="pseudo",
+                        help="pseudo: redact e-mails, URLs and long numbers and replace every word; scrub: only the "
+                             "redactions, real wording and names are kept (not anonymized)")
+    export.add_argument("--key", help="Secret for session and word pseudonyms (random per export if omitted; set it "
+                                      "to keep pseudonyms stable across exports)")
+    export.add_argument("--min-turns", type=int, default=1, help="Skip sessions with fewer user turns")
+
+    run = commands.add_parser("replay", help="Replay traces against a running api_server")
+    run.add_argument("--traces", required=True, help="JSON lines file written by export")
+    run.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the API")
+    run.add_argument("--speedup", type=float, default=1.0, help="Divide recorded times by this factor")
+    run.add_argument("--max-gap", type=float, help="Cap idle gaps between sessions and turns at this many seconds")
+    run.add_argument("--limit", type=int, help="Replay only the first N sessions")
+    run.add_argument("--template", default="default")
+    run.add_argument("--api-key", help="Value for the X-API-Key header")
+    run.add_argument("--timeout", type=float, default=300.0, help="Seconds before a request counts as failed")
+    run.add_argument("--buckets", default=",".join(map(str, DEFAULT_HISTORY_BUCKETS)),
+                     help="Lower bounds of the history-length buckets, in messages")
+    run.add_argument("--output", help="Write the JSON report here")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        key = args.key.encode("utf-8") if args.key else None
+        count = 0
+        with open(args.output, "w", encoding="utf-8") as f:
+            for trace in export_traces(args.db, args.text, key, args.min_turns):
+                f.write(json.dumps(trace) + "\n")
+                count += 1
+        logger.info(f"Exported {count} sessions to {args.output}")
+        return
+
+    with open(args.traces, encoding="utf-8") as f:
+        traces = [json.loads(line) for line in f if line.strip()]
+    if args.limit:
+        traces = traces[:args.limit]
+    buckets = sorted({int(b) for b in args.buckets.split(",") if b.strip()} | {0})
+    report = asyncio.run(replay(traces, args.url, args.speedup, args.template, args.api_key, args.timeout,
+                                buckets, args.max_gap))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    print_report(report)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
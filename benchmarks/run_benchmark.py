@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+# Make the application modules at the repo root importable when run as `python benchmarks/run_benchmark.py`
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(REPO_ROOT))
+sys.path.append(str(Path(__file__).resolve().parent))
+from config import Config
+from fake_services import add_service_arguments, free_port, load_passages, sample_queries, synthetic_passages
+
+logger = logging.getLogger(__name__)
+
+# run_benchmark.py: Drive RAGPipeline and the HTTP API against the fake services in fake_services.py at fixed
+# concurrency levels, and write throughput, latency percentiles and memory use as JSON so runs can be compared:
+#
+#   python benchmarks/run_benchmark.py --concurrency 1,4,16 --requests 200 --output before.json
+#
+# Each simulated client owns one session and sends --turns queries in a row, so history loads, truncate_context and
+# history writes are exercised as in real conversations. The run happens in a temporary directory, so the
+# conversation database and caches start empty and nothing in the working tree is touched. The fakes run in a separate
+# process so their work does not share the measured process's CPU or memory.
+
+ERROR_PREFIX = "I'm sorry, but I encountered an unexpected error"
+TARGETS = ("pipeline", "stream", "api")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "mean": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "max": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def rss_mb() -> float:
+    """Current resident set size; falls back to the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_load(request: Callable[[int, str, str], Awaitable[Dict[str, Any]]], queries: List[str], concurrency: int,
+                   total: int, turns: int, prefix: str) -> Dict[str, Any]:
+    """
+    Closed loop: `concurrency` clients each open the next session and send its `turns` queries one after another,
+    until `total` requests have been sent. request(i, query, session_id) returns a dict with at
+    least "ok"; any float fields it returns (such as "ttft") are summarised like latency.
+    """
+    latencies: List[float] = []
+    extra: Dict[str, List[float]] = {}
+    errors = 0
+    next_request = 0
+    next_session = 0
+
+    async def client():
+        nonlocal next_request, next_session, errors
+        while next_request < total:
+            session_id = f"{prefix}-{next_session}"
+            next_session += 1
+            for _ in range(turns):
+                if next_request >= total:
+                    return
+                i = next_request
+                next_request += 1
+                start = time.perf_counter()
+                try:
+                    result = await request(i, queries[i % len(queries)], session_id)
+                except Exception as e:
+                    logger.warning(f"Request {i} failed: {e}")
+                    result = {"ok": False}
+                latencies.append(time.perf_counter() - start)
+                if not result.get("ok"):
+                    errors += 1
+                for key, value in result.items():
+                    if isinstance(value, float):
+                        extra.setdefault(key, []).append(value)
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    duration = time.perf_counter() - start
+    result = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "memory_mb": {"rss_before": round(rss_before, 1), "rss_after": round(rss_mb(), 1),
+                      "peak_rss": round(peak_rss_mb(), 1)},
+    }
+    for key, values in extra.items():
+        result[f"{key}_ms"] = latency_summary(values)
+    if tracemalloc.is_tracing():
+        result["memory_mb"]["python_heap_peak"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.reset_peak()
+    return result
+
+
+async def bench_pipeline(args, queries: List[str], stream: bool) -> List[Dict[str, Any]]:
+    from RAG_pipeline import RAGPipeline
+
+    rag = RAGPipeline()
+    rag.initialize()
+    await rag.start()
+
+    async def query(i: int, text: str, session_id: str) -> Dict[str, Any]:
+        if not stream:
+            answer = await rag.process_query(text, "default", session_id=session_id)
+            return {"ok": not answer.startswith(ERROR_PREFIX)}
+        start = time.perf_counter()
+        ttft = None
+        parts = []
+        async for delta in rag.process_query_stream(text, "default", session_id=session_id):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(delta)
+        return {"ok": not "".join(parts).startswith(ERROR_PREFIX), "ttft": ttft or 0.0}
+
+    target = "stream" if stream else "pipeline"
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            logger.info(f"{target}: concurrency {concurrency}")
+            result = await run_load(query, queries, concurrency, args.requests, args.turns, f"{target}-c{concurrency}")
+            results.append({"target": target, **result})
+    finally:
+        await rag.shutdown()
+    return results
+
+
+async def bench_api(args, queries: List[str]) -> List[Dict[str, Any]]:
+    import uvicorn
+    from api_server import create_app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(), host="127.0.0.1", port=port, log_level="warning"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if serve_task.done():
+            serve_task.result()
+        await asyncio.sleep(0.05)
+
+    url = f"http://127.0.0.1:{port}/api/chat"
+    headers = {"X-API-Key": Config.ALLOWED_API_KEYS[0]} if Config.ALLOWED_API_KEYS else {}
+    connector = aiohttp.TCPConnector(limit=0)
+    results = []
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        async def query(i: int, text: str, session_id: str) -> Dict[str, Any]:
+            async with session.post(url, json={"query": text, "session_id": session_id}) as response:
+                body = await response.json()
+                if response.status != 200:
+                    return {"ok": False}
+                return {"ok": not body.get("answer", "").startswith(ERROR_PREFIX)}
+
+        try:
+            for concurrency in args.concurrency:
+                logger.info(f"api: concurrency {concurrency}")
+                result = await run_load(query, queries, concurrency, args.requests, args.turns, f"api-c{concurrency}")
+                results.append({"target": "api", **result})
+        finally:
+            server.should_exit = True
+            await serve_task
+    return results
+
+
+def start_fakes(args) -> subprocess.Popen:
+    """Start fake_services.py with the run's settings and wait until the fake Weaviate answers its ready check."""
+    weaviate_port, llm_port = free_port(), free_port()
+    command = [
+        sys.executable, str(Path(__file__).resolve().parent / "fake_services.py"),
+        "--weaviate-port", str(weaviate_port), "--llm-port", str(llm_port),
+        "--passages", str(args.passages), "--seed", str(args.seed),
+        "--weaviate-latency", str(args.weaviate_latency), "--llm-latency", str(args.llm_latency),
+        "--llm-tokens-per-second", str(args.llm_tokens_per_second),
+        "--llm-output-tokens", str(args.llm_output_tokens),
+        "--llm-max-concurrency", str(args.llm_max_concurrency),
+    ]
+    if args.documents_dir:
+        command += ["--documents-dir", args.documents_dir]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    ready_url = f"http://127.0.0.1:{weaviate_port}/v1/.well-known/ready"
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            urllib.request.urlopen(ready_url, timeout=1).close()
+            break
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("Fake services did not start")
+            time.sleep(0.1)
+
+    # Point the application at the fakes; everything else keeps its environment/default value
+    Config.WEAVIATE_URL = f"http://127.0.0.1:{weaviate_port}"
+    Config.JANAI_API_URL = f"http://127.0.0.1:{llm_port}/v1/chat/completions"
+    Config.JANAI_API_URLS = [Config.JANAI_API_URL]
+    Config.RETRIEVER_BACKEND = "weaviate"
+    Config.RETRIEVAL_MODE = "bm25"
+    # The api target runs setup_logging(); keep per-request logs off the measured path unless asked for
+    Config.LOG_LEVEL = Config.LOG_LEVEL or "WARNING"
+    return process
+
+
+async def main(args) -> Dict[str, Any]:
+    passages = load_passages(args.documents_dir) if args.documents_dir else synthetic_passages(args.passages, seed=args.seed)
+    queries = sample_queries(passages, args.distinct_queries, seed=args.seed)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    results = []
+    for target in args.targets:
+        if target == "api":
+            results.extend(await bench_api(args, queries))
+        else:
+            results.extend(await bench_pipeline(args, queries, stream=target == "stream"))
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "config": {
+            key: getattr(Config, key)
+            for key in ("RETRIEVAL_CACHE_ENABLED", "ANSWER_CACHE_ENABLED", "RERANK_ENABLED",
+                        "RETRIEVAL_NEIGHBOR_CHUNKS", "MAX_CONCURRENT_GENERATIONS", "GENERATION_QUEUE_SIZE",
+                        "SINGLE_FLIGHT_ENABLED", "CONVERSATION_WRITE_BATCH_SIZE", "TOKENIZER_PATH")
+        },
+        "passages": len(passages),
+        "results": results,
+    }
+
+
+def print_summary(report: Dict[str, Any]):
+    print(f"{'target':<10}{'conc':>6}{'reqs':>7}{'errs':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'rss MB':>9}")
+    for r in report["results"]:
+        lat = r["latency_ms"]
+        print(f"{r['target']:<10}{r['concurrency']:>6}{r['requests']:>7}{r['errors']:>6}{r['throughput_rps']:>9}"
+              f"{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}{r['memory_mb']['rss_after']:>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline and API against local fake services.")
+    parser.add_argument("--targets", default="pipeline,api",
+                        help=f"Comma-separated targets to run: {', '.join(TARGETS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--turns", type=int, default=3, help="Consecutive queries per session")
+    parser.add_argument("--distinct-queries", type=int, default=500, help="Size of the query pool")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Also report the Python heap peak (slows the run down)")
+    parser.add_argument("--output", help="Write the JSON report here (default: benchmarks/results/<timestamp>.json)")
+    add_service_arguments(parser)
+    args = parser.parse_args(argv)
+    args.targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"Unknown targets: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    if args.documents_dir:
+        args.documents_dir = os.path.abspath(args.documents_dir)
+    return args
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+    args = parse_args()
+    output = Path(args.output or REPO_ROOT / "benchmarks" / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    output = output.resolve()
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    os.chdir(workdir)
+    fakes = start_fakes(args)
+    try:
+        report = asyncio.run(main(args))
+    finally:
+        fakes.terminate()
+        fakes.wait()
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print_summary(report)
+    print(f"Report written to {output}")
@@ -0,0 +1,433 @@
+import asyncio
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+from array import array
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from cache import LRUCache, normalize_query
+from chunking import merge_passages
+from embeddings import STOPWORDS, load_embedder
+from metrics import STAGE_SECONDS
+from vector_index import VectorIndex, VectorIndexWriter, reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+# bm25_index.py: Embedded BM25 engine used instead of Weaviate when Config.RETRIEVER_BACKEND is "local". The
+# ingestion script writes an index directory; the API loads it memory-mapped, so startup is instant and pages are
+# shared with the OS cache. When built with an embedder, the directory also holds passage vectors (see
+# vector_index.py) for dense and hybrid retrieval.
+#
+# Index directory layout:
+#   meta.json          corpus statistics, BM25 parameters and the signature of the files it was built from
+#   vocab.json         term -> term id
+#   postings_ptr.npy   int64[V+1], CSR row pointers: postings of term t are [ptr[t], ptr[t+1])
+#   postings_doc.npy   int32, passage ids of each posting, ascending within a term
+#   postings_tf.npy    float32, term frequency of each posting
+#   doc_len.npy        float32[N], passage length in tokens
+#   texts.bin          UTF-8 passage texts, back to back
+#   text_ptr.npy       int64[N+1], byte offsets of each passage in texts.bin
+#   passage_meta.npy   int64[N, 4], (source id, chunk_index, start_offset, end_offset)
+#   sources.json       source id -> source path
+
+INDEX_FORMAT_VERSION = 1
+
+# Weaviate's BM25 defaults, so switching backends keeps rankings comparable
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, matching Weaviate's "word" tokenization closely enough for BM25."""
+    return _TOKEN.findall(text.lower())
+
+
+class BM25IndexWriter:
+    """
+    Build an index directory from a stream of passages. Passage texts are written to disk as they arrive; only the
+    postings are kept in memory (as compact arrays) until finish() writes them out.
+
+    The index is written next to path and swapped in when finished, so readers never see a partial index.
+
+    :param embedder: Optional embedder (see embeddings.py); passages are then also embedded into a vector index
+    :param ivf_min_vectors: Passage count from which the vector index gets IVF lists instead of exhaustive search
+    """
+
+    def __init__(self, path: str, k1: float = DEFAULT_K1, b: float = DEFAULT_B, embedder=None,
+                 ivf_min_vectors: int = 50000):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._tmp_path = f"{path}.tmp"
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+        os.makedirs(self._tmp_path)
+        self._texts = open(os.path.join(self._tmp_path, "texts.bin"), "wb")
+        self._text_ptr = array("q", [0])
+        self._doc_len = array("f")
+        self._meta = array("q")
+        self._sources: Dict[str, int] = {}
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self.ivf_min_vectors = ivf_min_vectors
+        self._vectors = VectorIndexWriter(self._tmp_path, embedder) if embedder is not None else None
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, passage: Dict[str, Any]):
+        """Add one passage (see chunking.chunk_document) to the index."""
+        content = passage.get("content") or ""
+        if self._vectors is not None:
+            self._vectors.add(content)
+        doc_id = self.num_docs
+        tokens = tokenize(content)
+        for term, tf in Counter(tokens).items():
+            docs, tfs = self._postings.setdefault(term, (array("i"), array("f")))
+            docs.append(doc_id)
+            tfs.append(tf)
+        self._doc_len.append(len(tokens))
+
+        encoded = content.encode("utf-8")
+        self._texts.write(encoded)
+        self._text_ptr.append(self._text_ptr[-1] + len(encoded))
+        source_id = self._sources.setdefault(passage.get("source") or "", len(self._sources))
+        self._meta.extend((
+            source_id,
+            passage.get("chunk_index") or 0,
+            passage.get("start_offset") or 0,
+            passage.get("end_offset") or len(content),
+        ))
+
+    def finish(self, signature: Optional[str] = None):
+        """
+        Write postings and metadata, then replace the index at path.
+
+        :param signature: Opaque description of the input (e.g. file sizes and mtimes) stored in meta.json, so the
+                          ingestion script can tell when a rebuild is unnecessary
+        """
+        self._texts.close()
+        if self._vectors is not None:
+            self._vectors.finish(self.ivf_min_vectors)
+        terms = sorted(self._postings)
+        ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum([len(self._postings[term][0]) for term in terms], dtype=np.int64)
+        postings_doc = np.empty(int(ptr[-1]), dtype=np.int32)
+        postings_tf = np.empty(int(ptr[-1]), dtype=np.float32)
+        for term_id, term in enumerate(terms):
+            docs, tfs = self._postings.pop(term)
+            postings_doc[ptr[term_id]:ptr[term_id + 1]] = np.frombuffer(docs, dtype=np.int32)
+            postings_tf[ptr[term_id]:ptr[term_id + 1]] = np.frombuffer(tfs, dtype=np.float32)
+
+        doc_len = np.frombuffer(self._doc_len, dtype=np.float32)
+        tmp = self._tmp_path
+        np.save(os.path.join(tmp, "postings_ptr.npy"), ptr)
+        np.save(os.path.join(tmp, "postings_doc.npy"), postings_doc)
+        np.save(os.path.join(tmp, "postings_tf.npy"), postings_tf)
+        np.save(os.path.join(tmp, "doc_len.npy"), doc_len)
+        np.save(os.path.join(tmp, "text_ptr.npy"), np.frombuffer(self._text_ptr, dtype=np.int64))
+        np.save(os.path.join(tmp, "passage_meta.npy"), np.frombuffer(self._meta, dtype=np.int64).reshape(-1, 4))
+        with open(os.path.join(tmp, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({term: term_id for term_id, term in enumerate(terms)}, f)
+        with open(os.path.join(tmp, "sources.json"), "w", encoding="utf-8") as f:
+            json.dump(sorted(self._sources, key=self._sources.get), f)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "format_version": INDEX_FORMAT_VERSION,
+                "num_docs": self.num_docs,
+                "avg_doc_len": float(doc_len.mean()) if self.num_docs else 0.0,
+                "k1": self.k1,
+                "b": self.b,
+                "signature": signature,
+            }, f, indent=1)
+
+        old_path = f"{self.path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(tmp, self.path)
+        # Processes still reading the old index keep their mappings; the files go away once they reload
+        shutil.rmtree(old_path, ignore_errors=True)
+        logger.info(f"Wrote local BM25 index with {self.num_docs} passages and {len(terms)} terms to {self.path}")
+
+    def abort(self):
+        self._texts.close()
+        if self._vectors is not None:
+            self._vectors.abort()
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+
+def build_index(passages: Iterable[Dict[str, Any]], path: str, signature: Optional[str] = None, embedder=None,
+                ivf_min_vectors: int = 50000) -> int:
+    """Build an index directory at path from a stream of passages. Returns the number of passages indexed."""
+    writer = BM25IndexWriter(path, embedder=embedder, ivf_min_vectors=ivf_min_vectors)
+    try:
+        for passage in passages:
+            writer.add(passage)
+        writer.finish(signature)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.num_docs
+
+
+def read_index_signature(path: str) -> Optional[str]:
+    """Signature the index at path was built with, or None if there is no readable index."""
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("signature")
+    except (OSError, ValueError):
+        return None
+
+
+class BM25Index:
+    """
+    Read-only view of an index directory. Arrays are memory-mapped; only the vocabulary and the per-passage length
+    normalisation are held in memory.
+
+    :param nprobe: IVF lists scanned per vector query
+    """
+
+    def __init__(self, path: str, nprobe: int = 8):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format {meta.get('format_version')} in {path}")
+        self.num_docs = meta["num_docs"]
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        with open(os.path.join(path, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+        with open(os.path.join(path, "sources.json"), "r", encoding="utf-8") as f:
+            self.sources: List[str] = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.postings_ptr = load("postings_ptr.npy")
+        self.postings_doc = load("postings_doc.npy")
+        self.postings_tf = load("postings_tf.npy")
+        self.text_ptr = load("text_ptr.npy")
+        self.passage_meta = load("passage_meta.npy")
+        avg_doc_len = meta["avg_doc_len"] or 1.0
+        # Length part of the BM25 denominator, precomputed once per passage
+        self.length_norm = (self.k1 * (1 - self.b + self.b * load("doc_len.npy") / avg_doc_len)).astype(np.float32)
+
+        self._texts_file = open(os.path.join(path, "texts.bin"), "rb")
+        if os.fstat(self._texts_file.fileno()).st_size:
+            self._texts = mmap.mmap(self._texts_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._texts = b""
+
+        # Passage vectors, when the index was built with an embedder
+        self.vectors: Optional[VectorIndex] = None
+        if os.path.exists(os.path.join(path, "vector_meta.json")):
+            self.vectors = VectorIndex(path, nprobe=nprobe)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """Score every passage containing a query term and return the top_k (passage id, score) pairs."""
+        if top_k <= 0 or not self.num_docs:
+            return []
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        matched = False
+        # Like Weaviate's "en" stopword preset, stopwords are dropped from queries but still indexed
+        for term in set(tokenize(query)) - STOPWORDS:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.postings_ptr[term_id], self.postings_ptr[term_id + 1]
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end]
+            df = end - start
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            # Each passage appears once per term, so the fancy-indexed add does not drop duplicates
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+            matched = True
+        if not matched:
+            return []
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        # Highest score first; ties go to the earlier passage so results are deterministic
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in hits]
+
+    def passage(self, doc_id: int) -> Dict[str, Any]:
+        """Return a passage in the same shape as a Weaviate result."""
+        start, end = self.text_ptr[doc_id], self.text_ptr[doc_id + 1]
+        source_id, chunk_index, start_offset, end_offset = (int(v) for v in self.passage_meta[doc_id])
+        return {
+            "content": self._texts[start:end].decode("utf-8"),
+            "source": self.sources[source_id],
+            "chunk_index": chunk_index,
+            "start_offset": start_offset,
+            "end_offset": end_offset,
+        }
+
+    def source_id(self, doc_id: int) -> int:
+        return int(self.passage_meta[doc_id][0])
+
+    def close(self):
+        if isinstance(self._texts, mmap.mmap):
+            self._texts.close()
+        self._texts_file.close()
+
+    def __del__(self):
+        # A retriever swapping in a reloaded index leaves the old one to be closed here, once no query uses it
+        if hasattr(self, "_texts_file"):
+            self.close()
+
+
+class LocalBM25Retriever:
+    """
+    In-process retriever over a local BM25 index, with the same interface as WeaviateRetriever.
+
+    :param index_path: Index directory written by the ingestion script
+    :param cache: Optional result cache keyed on (normalized query, top_k)
+    :param neighbor_chunks: Passages on each side of a hit to stitch onto it
+    :param version: Corpus version callable (see cache.CorpusVersion); the index is reloaded when it changes
+    :param mode: "bm25", "vector" or "hybrid" (BM25 and vector rankings fused by reciprocal rank); vector modes need
+                 an index built with an embedder and fall back to BM25 otherwise
+    :param candidates: Depth of each ranking fused in hybrid mode
+    :param rrf_k: Reciprocal rank fusion constant
+    :param nprobe: IVF lists scanned per vector query
+    """
+
+    def __init__(self, index_path: str, cache: Optional[LRUCache] = None, neighbor_chunks: int = 0,
+                 version: Optional[Callable[[], str]] = None, mode: str = "bm25", candidates: int = 50,
+                 rrf_k: int = 60, nprobe: int = 8):
+        self.index_path = index_path
+        self.cache = cache
+        self.neighbor_chunks = neighbor_chunks
+        self.version = version
+        self.mode = mode
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.nprobe = nprobe
+        self._loaded_version = None
+        # (index, query embedder matching the one the index vectors were built with), swapped as one so a query never
+        # pairs an index with another index's embedder
+        self._current: Tuple[Optional[BM25Index], Any] = (None, None)
+        self._load_lock = threading.Lock()
+        self._load()
+
+    @property
+    def index(self) -> Optional[BM25Index]:
+        return self._current[0]
+
+    @property
+    def embedder(self):
+        return self._current[1]
+
+    def _reload_pending(self) -> bool:
+        return self.version is not None and self.version() != self._loaded_version
+
+    def _load(self):
+        with self._load_lock:
+            version = self.version() if self.version else None
+            if self.index is not None and version == self._loaded_version:
+                # Another thread reloaded while this one waited
+                return
+            try:
+                index = BM25Index(self.index_path, nprobe=self.nprobe)
+                embedder = load_embedder(index.vectors.embedder_spec) if index.vectors is not None else None
+            except FileNotFoundError:
+                logger.error(f"No local index at {self.index_path}; "
+                             f"run weaviate/populate_weaviate_store.py --backend local")
+                self._loaded_version = version
+                return
+            except Exception as e:
+                logger.error(f"Could not load local index from {self.index_path}: {e}")
+                self._loaded_version = version
+                return
+            if self.mode != "bm25" and embedder is None:
+                logger.warning(f"Local index has no vectors; using BM25 instead of {self.mode} retrieval")
+            # The previous index is not closed: queries that started before the swap may still be reading its memory
+            # maps. Its files are released once the last of them drops its reference.
+            self._current = (index, embedder)
+            self._loaded_version = version
+        logger.info(f"Loaded local BM25 index with {index.num_docs} passages from {self.index_path}")
+
+    def retrieve(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
+        """
+        Retrieve the top_k passages for query from the local index.
+
+        :param query: The search query
+        :param top_k: Number of top results to return
+        :return: List of relevant documents
+        """
+        if self._reload_pending():
+            self._load()
+        if self.cache is not None:
+            docs = self.cache.get((normalize_query(query), top_k))
+            if docs is not None:
+                return docs
+        # One index (and embedder) for the whole query, even if a reload swaps in a new one meanwhile
+        loaded_version = self._loaded_version
+        index, embedder = self._current
+        if index is None:
+            return []
+        try:
+            with STAGE_SECONDS.time("local_search"):
+                hits = self._search(index, embedder, query, top_k)
+            docs = self._expand(index, hits) if self.neighbor_chunks > 0 else [index.passage(i) for i, _ in hits]
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {e}")
+            return []
+        if self.cache is not None and loaded_version == self._loaded_version:
+            self.cache.set((normalize_query(query), top_k), docs)
+        return docs
+
+    async def aretrieve(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
+        # BM25 scoring is vectorised and takes well under a millisecond, less than a thread hand-off would cost. Query
+        # embedding (vector and hybrid modes) and reloading the index after a corpus change run on a worker thread.
+        if self._reload_pending() or (self.mode != "bm25" and self.embedder is not None):
+            return await asyncio.to_thread(self.retrieve, query, top_k)
+        return self.retrieve(query, top_k)
+
+    def _search(self, index: "BM25Index", embedder, query: str, top_k: int) -> List[Tuple[int, float]]:
+        if self.mode == "bm25" or embedder is None:
+            return index.search(query, top_k)
+        query_vector = embedder.embed([query])[0]
+        if self.mode == "vector":
+            return index.vectors.search(query_vector, top_k)
+        depth = max(top_k, self.candidates)
+        lexical = [doc_id for doc_id, _ in index.search(query, depth)]
+        dense = [doc_id for doc_id, _ in index.vectors.search(query_vector, depth)]
+        return reciprocal_rank_fusion([lexical, dense], k=self.rrf_k)[:top_k]
+
+    def _expand(self, index: "BM25Index", hits: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+        """
+        Merge each hit with up to neighbor_chunks passages on either side. Passages of a file are stored consecutively,
+        so neighbours are the adjacent passage ids with the same source.
+        """
+        n = self.neighbor_chunks
+        covered = set()
+        docs = []
+        for doc_id, _ in hits:
+            if doc_id in covered:
+                continue
+            source_id = index.source_id(doc_id)
+            window = [
+                i for i in range(max(doc_id - n, 0), min(doc_id + n + 1, index.num_docs))
+                if i not in covered and index.source_id(i) == source_id
+            ]
+            covered.update(window)
+            hit = index.passage(doc_id)
+            docs.append({**merge_passages([index.passage(i) for i in window]), "chunk_index": hit["chunk_index"]})
+        return docs
+
+    def close(self):
+        index, self._current = self.index, (None, None)
+        if index is not None:
+            index.close()
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# cache.py: In-process caches shared by the pipeline components, plus the corpus version marker that the ingestion
+# script bumps so cached retrieval results never outlive the documents they came from.
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for use in cache keys: case-folded with whitespace collapsed."""
+    return " ".join(query.casefold().split())
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and (optionally) approximate size in bytes, with an optional TTL.
+
+    :param max_entries: Maximum number of entries kept
+    :param max_bytes: Maximum total size of values as reported by sizeof (None for no limit)
+    :param ttl: Seconds an entry stays valid (None for no expiry)
+    :param sizeof: Callable returning the approximate size of a value in bytes
+    :param version: Callable returning the current data version; the cache is cleared whenever it changes
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None, version: Optional[Callable[[], str]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 0)
+        self.version = version
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._version_seen = version() if version else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        if self.version is None:
+            return
+        current = self.version()
+        if current != self._version_seen:
+            if self._data:
+                logger.info(f"Corpus version changed ({self._version_seen} -> {current}); clearing {len(self._data)} cached entries")
+            self._data.clear()
+            self._bytes = 0
+            self._version_seen = current
+            self.invalidations += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._check_version()
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._check_version()
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries
+                                  or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def fingerprint_documents(docs: List[Dict[str, Any]]) -> str:
+    """Stable hash of a retrieval result (sources and contents, in order)."""
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update((doc.get("source") or "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update((doc.get("content") or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class AnswerCache:
+    """
+    Cache of final answers for stateless queries, keyed on (template, normalized query, document fingerprint, model).
+
+    Entries live in an in-memory LRU and, when db_path is given, are also written to a SQLite file so they survive
+    restarts. Both layers are tied to the corpus version: memory is cleared and persisted rows from an older corpus are
+    ignored once the ingestion script bumps it. The SQLite file is accessed through one long-lived connection (WAL mode)
+    that worker threads take turns on.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: Optional[float] = 3600, db_path: Optional[str] = None,
+                 version: Optional[Callable[[], str]] = None):
+        self.ttl = ttl
+        self.db_path = db_path
+        self.version = version or (lambda: "")
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl, version=self.version)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if self.db_path:
+            self.init_db()
+
+    @staticmethod
+    def make_key(template: str, query: str, docs: List[Dict[str, Any]], model_name: str) -> str:
+        raw = json.dumps([template, normalize_query(query), fingerprint_documents(docs), model_name])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def init_db(self):
+        # Used from the asyncio.to_thread workers, one at a time under _db_lock
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._db_lock:
+            cursor = self._conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT,
+                    corpus_version TEXT,
+                    created_at REAL
+                )
+            ''')
+            # Drop rows that can no longer be served
+            cursor.execute('DELETE FROM answers WHERE corpus_version != ?', (self.version(),))
+            if self.ttl is not None:
+                cursor.execute('DELETE FROM answers WHERE created_at < ?', (time.time() - self.ttl,))
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        answer = self.memory.get(key)
+        if answer is not None or not self.db_path:
+            return answer
+        return self._load(key)
+
+    def _load(self, key: str) -> Optional[str]:
+        with self._db_lock:
+            if self._conn is None:
+                return None
+            cursor = self._conn.cursor()
+            cursor.execute(
+                'SELECT answer, created_at FROM answers WHERE key = ? AND corpus_version = ?',
+                (key, self.version())
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        answer, created_at = row
+        if self.ttl is not None and created_at + self.ttl < time.time():
+            return None
+        self.memory.set(key, answer)
+        return answer
+
+    def set(self, key: str, answer: str):
+        self.memory.set(key, answer)
+        if not self.db_path:
+            return
+        with self._db_lock:
+            if self._conn is None:
+                return
+            cursor = self._conn.cursor()
+            cursor.execute(
+                'INSERT OR REPLACE INTO answers (key, answer, corpus_version, created_at) VALUES (?, ?, ?, ?)',
+                (key, answer, self.version(), time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        """Close the SQLite connection, if the cache is persisted."""
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def aget(self, key: str) -> Optional[str]:
+        # Memory hits are served inline; only the SQLite lookup is moved off the event loop
+        answer = self.memory.get(key)
+        if answer is not None or not self.db_path:
+            return answer
+        return await asyncio.to_thread(self._load, key)
+
+    async def aset(self, key: str, answer: str):
+        if not self.db_path:
+            self.memory.set(key, answer)
+            return
+        await asyncio.to_thread(self.set, key, answer)
+
+
+class CorpusVersion:
+    """
+    Reads the corpus version marker written by the ingestion script. The file is re-read at most once per
+    check_interval seconds so callers can consult it on every cache access.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._value = ""
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def __call__(self) -> str:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._value
+        with self._lock:
+            if now - self._checked_at >= self.check_interval:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._value = f.read().strip()
+                except FileNotFoundError:
+                    self._value = ""
+                self._checked_at = now
+        return self._value
+
+
+def bump_corpus_version(path: str) -> str:
+    """Write a fresh corpus version to path, invalidating caches keyed on the previous one."""
+    version = uuid.uuid4().hex
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    logger.info(f"Bumped corpus version to {version}")
+    return version
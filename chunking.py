@@ -0,0 +1,114 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+from token_budget import cut_at_boundary
+
+# chunking.py: Splits documents into overlapping passages at ingest time. Windows are built from whole paragraphs
+# where possible, a Markdown heading starts a new passage, and every passage records its character offsets in the
+# source file so neighbouring passages can be stitched back together at query time.
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n+")
+_HEADING = re.compile(r"#{1,6}\s")
+
+
+def split_blocks(text: str, max_chars: int) -> List[Tuple[int, int, bool]]:
+    """
+    Split text into paragraph blocks as (start, end, is_heading) offsets. Paragraphs longer than max_chars are cut
+    into pieces on sentence or word boundaries.
+    """
+    blocks = []
+    pos = 0
+    for match in list(_PARAGRAPH_BREAK.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        start = pos
+        # Skip leading whitespace so offsets point at real content
+        while start < end and text[start].isspace():
+            start += 1
+        is_heading = bool(_HEADING.match(text, start))
+        while start < end:
+            piece = cut_at_boundary(text[start:end], max_chars)
+            if not piece:
+                piece = text[start:min(end, start + max_chars)]
+            blocks.append((start, start + len(piece), is_heading))
+            is_heading = False
+            start += len(piece)
+            while start < end and text[start].isspace():
+                start += 1
+        pos = match.end() if match else len(text)
+    return blocks
+
+
+def chunk_text(text: str, max_chars: int = 1500, overlap_chars: int = 200) -> List[Tuple[int, int]]:
+    """
+    Group paragraph blocks into windows of at most max_chars. Consecutive windows share up to overlap_chars of
+    trailing text, except across a heading, which always starts a fresh window once the current one is at least
+    a quarter full.
+
+    :return: (start, end) character offsets of each window
+    """
+    # Long paragraphs are cut into pieces no larger than the overlap, so windows inside them can still overlap
+    piece_chars = min(max(overlap_chars, max_chars // 8, 1), max_chars)
+    windows = []
+    current: List[Tuple[int, int]] = []
+    for start, end, is_heading in split_blocks(text, piece_chars):
+        if current:
+            too_long = end - current[0][0] > max_chars
+            at_heading = is_heading and current[-1][1] - current[0][0] >= max_chars // 4
+            if too_long or at_heading:
+                windows.append((current[0][0], current[-1][1]))
+                carry = []
+                if not at_heading:
+                    for block in reversed(current):
+                        if current[-1][1] - block[0] > overlap_chars:
+                            break
+                        carry.insert(0, block)
+                    while carry and end - carry[0][0] > max_chars:
+                        carry.pop(0)
+                current = carry
+        current.append((start, end))
+    if current:
+        windows.append((current[0][0], current[-1][1]))
+    return windows
+
+
+def chunk_document(document: Dict[str, Any], max_chars: int = 1500, overlap_chars: int = 200) -> List[Dict[str, Any]]:
+    """
+    Split a {"source", "content"} document into passages carrying source, chunk_index and start/end offsets.
+    """
+    content = document["content"]
+    return [
+        {
+            "content": content[start:end],
+            "source": document["source"],
+            "chunk_index": index,
+            "start_offset": start,
+            "end_offset": end,
+        }
+        for index, (start, end) in enumerate(chunk_text(content, max_chars, overlap_chars))
+    ]
+
+
+def merge_passages(passages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Stitch passages from one source back into a single passage, dropping the text they share through overlap.
+    Passages are ordered by offset; gaps between non-adjacent passages are joined with a blank line.
+    """
+    passages = sorted(passages, key=lambda p: p.get("start_offset") or 0)
+    first = passages[0]
+    content = first.get("content") or ""
+    end = first.get("end_offset") or len(content)
+    for passage in passages[1:]:
+        start = passage.get("start_offset") or 0
+        text = passage.get("content") or ""
+        if start < end:
+            text = text[end - start:]
+        elif text:
+            # Windows only meet mid-paragraph at a single space; wider gaps are paragraph breaks
+            content += " " if start - end == 1 else "\n\n"
+        content += text
+        end = max(end, passage.get("end_offset") or end)
+    return {
+        **first,
+        "content": content,
+        "end_offset": end,
+    }
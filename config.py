@@ -12,16 +12,133 @@ class Config:
     WEAVIATE_URL = os.environ.get("WEAVIATE_URL", "http://localhost:8080")
     # Jan.ai API URL for language model interactions
     JANAI_API_URL = os.environ.get("JANAI_API_URL", "http://localhost:1337/v1/chat/completions")
+    # Several interchangeable LLM servers, comma-separated: requests go to the one with the fewest in flight and retries
+    # fail over to another. Empty uses JANAI_API_URL alone.
+    JANAI_API_URLS = [
+        u.strip() for u in os.environ.get("JANAI_API_URLS", "").split(",") if u.strip()
+    ] or [JANAI_API_URL]
+    # Passive health checks: consecutive failures (connection errors, 5xx, 429) after which a server is taken out of
+    # rotation, and the base seconds it stays out (doubling while it keeps failing)
+    JANAI_MAX_FAILURES = int(os.environ.get("JANAI_MAX_FAILURES", "3"))
+    JANAI_EJECTION_TIME = float(os.environ.get("JANAI_EJECTION_TIME", "30"))
     # Name of the language model to use
     JANAI_MODEL_NAME = os.environ.get("JANAI_MODEL_NAME", "mistral-ins-7b-q4")
     # Optional API key for Jan.ai/OpenAI-compatible endpoint
     JANAI_API_KEY = os.environ.get("JANAI_API_KEY", None)
     # Max tokens for LLM output (many servers reject very large numbers)
     JANAI_MAX_TOKENS = int(os.environ.get("JANAI_MAX_TOKENS", "1024"))
+    # Connection pool for the LLM HTTP session: total and per-host connection caps, idle keep-alive (seconds) and
+    # DNS cache TTL (seconds)
+    JANAI_POOL_LIMIT = int(os.environ.get("JANAI_POOL_LIMIT", "100"))
+    JANAI_POOL_LIMIT_PER_HOST = int(os.environ.get("JANAI_POOL_LIMIT_PER_HOST", "20"))
+    JANAI_KEEPALIVE_TIMEOUT = float(os.environ.get("JANAI_KEEPALIVE_TIMEOUT", "30"))
+    JANAI_DNS_CACHE_TTL = int(os.environ.get("JANAI_DNS_CACHE_TTL", "300"))
+    # Seconds one LLM request (a whole stream included) may take before the backend counts as failed and the request
+    # fails over to another one
+    JANAI_REQUEST_TIMEOUT = float(os.environ.get("JANAI_REQUEST_TIMEOUT", "120"))
+    # Retrieval backend: "weaviate", or "local" for the embedded BM25 index at LOCAL_INDEX_PATH (built by
+    # weaviate/populate_weaviate_store.py --backend local)
+    RETRIEVER_BACKEND = os.environ.get("RETRIEVER_BACKEND", "weaviate").lower()
+    LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", "local_index")
+    # Retrieval mode: "bm25", "vector" or "hybrid" (BM25 and vector rankings fused by reciprocal rank). Vector modes use
+    # embeddings computed at ingest time by EMBEDDER: "hashing" (offline feature hashing, EMBEDDING_DIM dimensions) or
+    # "st:<model dir>" for a local sentence-transformers model; an empty EMBEDDER skips embeddings. It defaults to
+    # "hashing" only when RETRIEVAL_MODE needs vectors, so plain BM25 ingestion does not compute unused embeddings.
+    RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "bm25").lower()
+    EMBEDDER = os.environ.get("EMBEDDER", "" if RETRIEVAL_MODE == "bm25" else "hashing")
+    EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "384"))
+    # Hybrid retrieval: depth of each ranking that is fused, and the reciprocal rank fusion constant
+    HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "50"))
+    RRF_K = int(os.environ.get("RRF_K", "60"))
+    # Local vector index: passage count from which IVF lists replace exhaustive search, and lists scanned per query
+    VECTOR_IVF_MIN_VECTORS = int(os.environ.get("VECTOR_IVF_MIN_VECTORS", "50000"))
+    VECTOR_NPROBE = int(os.environ.get("VECTOR_NPROBE", "8"))
+    # Post-retrieval reranking: fetch RERANK_CANDIDATES passages, rescore them against the query and keep up to
+    # RERANK_TOP_K chosen by maximal marginal relevance, dropping passages at least RERANK_DUPLICATE_THRESHOLD similar
+    # to one already kept
+    RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")
+    RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "20"))
+    RERANK_TOP_K = int(os.environ.get("RERANK_TOP_K", "5"))
+    RERANK_MMR_LAMBDA = float(os.environ.get("RERANK_MMR_LAMBDA", "0.7"))
+    RERANK_DUPLICATE_THRESHOLD = float(os.environ.get("RERANK_DUPLICATE_THRESHOLD", "0.9"))
+    # Worker threads used to run blocking Weaviate queries off the event loop
+    RETRIEVER_MAX_WORKERS = int(os.environ.get("RETRIEVER_MAX_WORKERS", "4"))
+    # In-process cache of retrieval results keyed on (normalized query, top_k)
+    RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "1024"))
+    RETRIEVAL_CACHE_MAX_BYTES = int(os.environ.get("RETRIEVAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL", "300"))
+    # Opt-in cache of final answers for queries from sessions with no prior history. ANSWER_CACHE_PATH names a SQLite
+    # file that keeps entries across restarts; leave it empty for a memory-only cache.
+    ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "512"))
+    ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+    ANSWER_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH", "")
+    # Admission control for the API: generations run against the LLM at once, requests allowed to wait for a slot or
+    # for an earlier request of their session, seconds a request may wait, and the Retry-After (seconds) sent with
+    # 503/429 responses when the queue is full
+    MAX_CONCURRENT_GENERATIONS = int(os.environ.get("MAX_CONCURRENT_GENERATIONS", "4"))
+    GENERATION_QUEUE_SIZE = int(os.environ.get("GENERATION_QUEUE_SIZE", "32"))
+    GENERATION_QUEUE_TIMEOUT = float(os.environ.get("GENERATION_QUEUE_TIMEOUT", "30"))
+    GENERATION_RETRY_AFTER = int(os.environ.get("GENERATION_RETRY_AFTER", "5"))
+    # Let concurrent /api/chat requests that open a conversation with the same (template, normalized query) share one
+    # retrieval and generation
+    SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+    # /api/chat/batch: LLM calls all batch requests together run at once (on top of the interactive
+    # MAX_CONCURRENT_GENERATIONS), and the most items accepted per request
+    BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+    BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "10000"))
+    # Per-stage latency histograms and counters, served in Prometheus text format at /metrics
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    # Marker file rewritten by weaviate/populate_weaviate_store.py after each ingestion; caches are dropped when it
+    # changes. The file is re-read at most every CORPUS_VERSION_CHECK_INTERVAL seconds.
+    CORPUS_VERSION_FILE = os.environ.get("CORPUS_VERSION_FILE", ".corpus_version")
+    CORPUS_VERSION_CHECK_INTERVAL = float(os.environ.get("CORPUS_VERSION_CHECK_INTERVAL", "1"))
+    # Conversation history store: read connections kept open, and the most queued writes committed per transaction
+    CONVERSATION_READER_POOL_SIZE = int(os.environ.get("CONVERSATION_READER_POOL_SIZE", "4"))
+    CONVERSATION_WRITE_BATCH_SIZE = int(os.environ.get("CONVERSATION_WRITE_BATCH_SIZE", "256"))
+    # Optional local tokenizer vocab for exact token counts: a Hugging Face tokenizer.json (needs `tokenizers`) or a
+    # SentencePiece .model file (needs `sentencepiece`). Empty uses the len(text)//4 estimate.
+    TOKENIZER_PATH = os.environ.get("TOKENIZER_PATH", "")
+    # Memoized token counts for repeated strings
+    TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", "8192"))
+    # Prompt budget: share of the tokens left after template and query reserved for history (the rest, plus any
+    # history share left unused, goes to retrieved context), and the most tokens any single document may take
+    HISTORY_BUDGET_SHARE = float(os.environ.get("HISTORY_BUDGET_SHARE", "0.35"))
+    MAX_DOC_TOKENS = int(os.environ.get("MAX_DOC_TOKENS", "375"))
+    # History summarization: maximum concurrent summarization LLM calls, and memoized chunk summaries kept
+    SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
+    SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "1024"))
+    # Ingestion (weaviate/populate_weaviate_store.py): objects per batch request, parallel batch workers, and retry
+    # rounds / base backoff delay in seconds for objects Weaviate rejects
+    INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "100"))
+    INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+    INGEST_MAX_RETRIES = int(os.environ.get("INGEST_MAX_RETRIES", "3"))
+    INGEST_RETRY_DELAY = float(os.environ.get("INGEST_RETRY_DELAY", "1"))
+    # Streaming ingestion: passages buffered between the file reader thread and the uploader, and the file size in
+    # bytes from which files are memory-mapped instead of read
+    INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "1000"))
+    INGEST_MMAP_THRESHOLD = int(os.environ.get("INGEST_MMAP_THRESHOLD", str(16 * 1024 * 1024)))
+    # Passage chunking at ingest time: window size and overlap between consecutive windows, in characters
+    CHUNK_SIZE_CHARS = int(os.environ.get("CHUNK_SIZE_CHARS", "1500"))
+    CHUNK_OVERLAP_CHARS = int(os.environ.get("CHUNK_OVERLAP_CHARS", "200"))
+    # Neighbouring passages stitched onto each side of a retrieved passage (0 returns passages as stored)
+    RETRIEVAL_NEIGHBOR_CHUNKS = int(os.environ.get("RETRIEVAL_NEIGHBOR_CHUNKS", "0"))
+    # Manifest of ingested files (size, mtime, content hash, Weaviate id) used for incremental syncs
+    INGEST_MANIFEST_PATH = os.environ.get("INGEST_MANIFEST_PATH", ".ingest_manifest.json")
     # Maximum number of retries for API calls
     MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "3"))
     # Base delay for exponential backoff in seconds
     BASE_DELAY = float(os.environ.get("BASE_DELAY", "1"))
+    # Logging (logging_config.setup_logging): LOG_PROFILE "production" (INFO, written by a background thread) or
+    # "development" (DEBUG with prompt dumps, written synchronously; opt-in). LOG_LEVEL and LOG_ASYNC override the
+    # profile when set.
+    LOG_PROFILE = os.environ.get("LOG_PROFILE", "production").lower()
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "")
+    LOG_ASYNC = os.environ.get("LOG_ASYNC", "").lower()
+    # Prompt dumps at DEBUG: share of prompts logged, and characters kept of each (-1 for no cap)
+    LOG_PROMPT_SAMPLE_RATE = float(os.environ.get("LOG_PROMPT_SAMPLE_RATE", "1"))
+    LOG_PROMPT_MAX_CHARS = int(os.environ.get("LOG_PROMPT_MAX_CHARS", "2000"))
     # Comma-separated list of API keys allowed to access our FastAPI endpoints
     # Example: ALLOWED_API_KEYS="key1,key2,key3". If empty, auth is disabled.
     ALLOWED_API_KEYS = [
@@ -1,76 +1,274 @@
+import asyncio
+import atexit
 import logging
-from typing import List, Dict
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 import sqlite3
 from datetime import datetime
 
+from metrics import STAGE_SECONDS
+
 logger = logging.getLogger(__name__)
 
+# Pragmas applied to every connection. WAL lets readers run while the writer commits; synchronous=NORMAL only fsyncs
+# at checkpoints, which is safe in WAL mode (a crash can lose the last commits but never corrupts the database).
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+_STOP = object()
+
+
 class ConversationManager:
-    def __init__(self, db_path: str = 'conversations.db'):
+    """
+    SQLite-backed conversation history.
+
+    Writes go through a write-behind queue: add_message() returns immediately and a single writer thread commits
+    queued messages in batches, one transaction per batch. Reads use a small pool of long-lived connections and first
+    wait for writes queued before them, so a session always sees its own messages.
+    """
+
+    def __init__(self, db_path: str = 'conversations.db', reader_pool_size: int = 4, write_batch_size: int = 256):
         self.db_path = db_path
+        self.write_batch_size = write_batch_size
+        self._writer_conn = self._connect()
+        self._writer_conn.execute("PRAGMA journal_mode=WAL")
         self.init_db()
 
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(reader_pool_size):
+            self._readers.put(self._connect())
+        self._reader_pool_size = reader_pool_size
+        self._executor = ThreadPoolExecutor(max_workers=reader_pool_size, thread_name_prefix="conversation-reader")
+
+        self._write_queue: "queue.Queue" = queue.Queue()
+        self._write_cond = threading.Condition()
+        self._writes_submitted = 0
+        self._writes_done = 0
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are handed between threads (reader pool, writer thread) but never used by two at once
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    role TEXT,
-                    content TEXT
-                )
-            ''')
-            # Ensure session_id column exists for per-visitor chats
-            try:
-                cursor.execute("PRAGMA table_info(conversations)")
-                cols = [row[1] for row in cursor.fetchall()]
-                if 'session_id' not in cols:
-                    cursor.execute("ALTER TABLE conversations ADD COLUMN session_id TEXT DEFAULT 'default'")
-                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_session_ts ON conversations(session_id, timestamp)")
-            except Exception:
-                # Best-effort; continue even if migration fails
-                pass
-            conn.commit()
+        conn = self._writer_conn
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                role TEXT,
+                content TEXT
+            )
+        ''')
+        # Rolling per-session summaries; last_message_id is the newest message already folded into the summary
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT,
+                last_message_id INTEGER,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Ensure session_id column exists for per-visitor chats
+        try:
+            cursor.execute("PRAGMA table_info(conversations)")
+            cols = [row[1] for row in cursor.fetchall()]
+            if 'session_id' not in cols:
+                cursor.execute("ALTER TABLE conversations ADD COLUMN session_id TEXT DEFAULT 'default'")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_session_ts ON conversations(session_id, timestamp)")
+            # Recent-message lookups order by id, which unlike the second-resolution timestamp is strictly increasing
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_session_id ON conversations(session_id, id)")
+        except Exception:
+            # Best-effort; continue even if migration fails
+            pass
+        conn.commit()
+
+    # --- write-behind queue -------------------------------------------------------------------------------------
+
+    def _submit(self, sql: str, params, wait: bool = False, many: bool = False, session_id: Optional[str] = None):
+        # many=True runs sql once per row of params (executemany), in the same transaction. session_id only labels the
+        # write in error logs.
+        if self._closed:
+            raise RuntimeError("ConversationManager is closed")
+        future = Future() if wait else None
+        with self._write_cond:
+            self._writes_submitted += 1
+        self._write_queue.put((sql, params, many, session_id, future))
+        if future is not None:
+            future.result()
+
+    def _write_loop(self):
+        while True:
+            op = self._write_queue.get()
+            if op is _STOP:
+                break
+            batch = [op]
+            stop = False
+            while len(batch) < self.write_batch_size:
+                try:
+                    op = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is _STOP:
+                    stop = True
+                    break
+                batch.append(op)
+            self._commit_batch(batch)
+            if stop:
+                break
+
+    @staticmethod
+    def _execute(conn, sql, params, many):
+        if many:
+            conn.executemany(sql, params)
+        else:
+            conn.execute(sql, params)
+
+    def _commit_batch(self, batch):
+        conn = self._writer_conn
+        errors = [None] * len(batch)
+        try:
+            with STAGE_SECONDS.time("history_commit"), conn:
+                for sql, params, many, _, _ in batch:
+                    self._execute(conn, sql, params, many)
+        except Exception as e:
+            logger.warning(f"Error committing {len(batch)} conversation writes ({e}); retrying them one by one")
+            # The batch was rolled back as a whole; commit each write on its own so only the failing ones are lost
+            for i, (sql, params, many, session_id, _) in enumerate(batch):
+                try:
+                    with conn:
+                        self._execute(conn, sql, params, many)
+                except Exception as e:
+                    logger.error(f"Dropped conversation write for session {session_id or 'unknown'}: {e}")
+                    errors[i] = e
+        with self._write_cond:
+            self._writes_done += len(batch)
+            self._write_cond.notify_all()
+        for (_, _, _, _, future), error in zip(batch, errors):
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every write queued so far has been committed. Returns False on timeout."""
+        with self._write_cond:
+            target = self._writes_submitted
+            return self._write_cond.wait_for(lambda: self._writes_done >= target, timeout=timeout)
+
+    # --- public API -----------------------------------------------------------------------------------------------
 
     def add_message(self, role: str, content: str, session_id: str = 'default'):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO conversations (role, content, session_id) VALUES (?, ?, ?)',
-                (role, content, session_id)
-            )
-            conn.commit()
+        self._submit(
+            'INSERT INTO conversations (role, content, session_id) VALUES (?, ?, ?)',
+            (role, content, session_id),
+            session_id=session_id
+        )
+
+    def add_messages(self, messages: List[Tuple[str, str, str]]):
+        """Queue many (role, content, session_id) rows as one write, committed in a single transaction in order."""
+        if messages:
+            rows = list(messages)
+            self._submit('INSERT INTO conversations (role, content, session_id) VALUES (?, ?, ?)', rows, many=True,
+                         session_id=", ".join(sorted({row[2] for row in rows})))
 
     def get_recent_messages(self, limit: int = 20, session_id: str = 'default') -> List[Dict[str, str]]:
-        with sqlite3.connect(self.db_path) as conn:
+        with STAGE_SECONDS.time("history_load"):
+            return self._get_recent_messages(limit, session_id)
+
+    def _get_recent_messages(self, limit: int, session_id: str) -> List[Dict[str, str]]:
+        self.flush()
+        conn = self._readers.get()
+        try:
             cursor = conn.cursor()
             cursor.execute(
-                'SELECT role, content FROM conversations WHERE session_id = ? ORDER BY timestamp DESC LIMIT ?',
+                'SELECT id, role, content FROM conversations WHERE session_id = ? ORDER BY id DESC LIMIT ?',
                 (session_id, limit)
             )
-            return [{'role': role, 'content': content} for role, content in cursor.fetchall()][::-1]
+            return [{'id': msg_id, 'role': role, 'content': content} for msg_id, role, content in cursor.fetchall()][::-1]
+        finally:
+            self._readers.put(conn)
 
-    def clear_history(self, session_id: str | None = None):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            if session_id:
-                cursor.execute('DELETE FROM conversations WHERE session_id = ?', (session_id,))
-            else:
-                cursor.execute('DELETE FROM conversations')
-            conn.commit()
+    async def aget_recent_messages(self, limit: int = 20, session_id: str = 'default') -> List[Dict[str, str]]:
+        """Async variant of get_recent_messages() that runs on the reader pool instead of the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.get_recent_messages, limit, session_id)
 
-    def summarize_old_conversations(self, days_old: int = 7):
-        # This method would summarize conversations older than 'days_old'
-        # and replace them with a summary in the database
-        # Implementation depends on the specific summarization logic you want to use
-        pass
+    def get_summary(self, session_id: str = 'default') -> Tuple[str, int]:
+        """
+        Return the stored rolling summary for a session and its watermark: the id of the last message folded into it.
+        Sessions without a summary return ("", 0).
+        """
+        with STAGE_SECONDS.time("summary_load"):
+            return self._get_summary(session_id)
 
-    def prune_old_conversations(self, days_old: int = 30):
-        with sqlite3.connect(self.db_path) as conn:
+    def _get_summary(self, session_id: str) -> Tuple[str, int]:
+        self.flush()
+        conn = self._readers.get()
+        try:
             cursor = conn.cursor()
             cursor.execute(
-                'DELETE FROM conversations WHERE timestamp < datetime("now", ?)',
-                (f'-{days_old} days',)
+                'SELECT summary, last_message_id FROM conversation_summaries WHERE session_id = ?',
+                (session_id,)
             )
-            conn.commit()
+            row = cursor.fetchone()
+            return (row[0], row[1]) if row else ("", 0)
+        finally:
+            self._readers.put(conn)
+
+    async def aget_summary(self, session_id: str = 'default') -> Tuple[str, int]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.get_summary, session_id)
+
+    def save_summary(self, session_id: str, summary: str, last_message_id: int):
+        self._submit(
+            'INSERT OR REPLACE INTO conversation_summaries (session_id, summary, last_message_id, updated_at) '
+            'VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+            (session_id, summary, last_message_id),
+            session_id=session_id
+        )
+
+    def clear_history(self, session_id: str | None = None):
+        if session_id:
+            self._submit('DELETE FROM conversation_summaries WHERE session_id = ?', (session_id,), session_id=session_id)
+            self._submit('DELETE FROM conversations WHERE session_id = ?', (session_id,), wait=True,
+                         session_id=session_id)
+        else:
+            self._submit('DELETE FROM conversation_summaries', ())
+            self._submit('DELETE FROM conversations', (), wait=True)
+
+    def prune_old_conversations(self, days_old: int = 30):
+        self._submit(
+            'DELETE FROM conversations WHERE timestamp < datetime("now", ?)',
+            (f'-{days_old} days',),
+            wait=True
+        )
+
+    def close(self):
+        """Commit queued writes, stop the writer thread and close all connections."""
+        if self._closed:
+            return
+        self._closed = True
+        self._write_queue.put(_STOP)
+        self._writer.join()
+        self._executor.shutdown(wait=True)
+        self._writer_conn.close()
+        for _ in range(self._reader_pool_size):
+            self._readers.get().close()
+        atexit.unregister(self.close)
@@ -1,15 +1,41 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import weaviate
+from cache import LRUCache, normalize_query
+from metrics import STAGE_SECONDS
+from chunking import merge_passages
+from vector_index import reciprocal_rank_fusion
 
 logger = logging.getLogger(__name__)
 
 # document_retriever.py: This file contains the WeaviateRetriever class, which is responsible for retrieving relevant
 # documents from the Weaviate database.
 
+# Passage properties stored by the ingestion script (see chunking.py)
+PASSAGE_PROPERTIES = ["content", "source", "chunk_index", "start_offset", "end_offset"]
+
 class WeaviateRetriever:
-    def __init__(self, client: weaviate.Client):
+    def __init__(self, client: weaviate.Client, max_workers: int = 4, cache: Optional[LRUCache] = None,
+                 neighbor_chunks: int = 0, mode: str = "bm25", embedder=None, candidates: int = 50,
+                 rrf_k: int = 60):
         self.client = client
+        # "bm25", "vector" (near-vector search over the embeddings stored at ingest time) or "hybrid" (both rankings
+        # fused by reciprocal rank); the vector modes need an embedder matching the ingestion one
+        self.mode = mode if embedder is not None else "bm25"
+        self.embedder = embedder
+        # Depth of each ranking fused in hybrid mode, and the reciprocal rank fusion constant
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        # Passages on each side of a hit to stitch onto it, for more surrounding context per result
+        self.neighbor_chunks = neighbor_chunks
+        # Optional result cache keyed on (normalized query, top_k); see Config.RETRIEVAL_CACHE_*
+        self.cache = cache
+        # The v3 client is synchronous; async callers run queries on this bounded pool so the event loop keeps serving
+        # other requests while Weaviate answers.
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
 
     def retrieve(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
         """
@@ -19,15 +45,124 @@ class WeaviateRetriever:
         :param top_k: Number of top results to return
         :return: List of relevant documents
         """
+        cached = self._cache_get(query, top_k)
+        if cached is not None:
+            return cached
+        return self._fetch(query, top_k)
+
+    async def aretrieve(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
+        """
+        Async variant of retrieve() that runs the blocking Weaviate query on the retriever's thread pool.
+
+        :param query: The search query
+        :param top_k: Number of top results to return
+        :return: List of relevant documents
+        """
+        cached = self._cache_get(query, top_k)
+        if cached is not None:
+            return cached
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="weaviate-retriever")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._fetch, query, top_k)
+
+    def _cache_get(self, query: str, top_k: int) -> Optional[List[Dict[str, Any]]]:
+        if self.cache is None:
+            return None
+        docs = self.cache.get((normalize_query(query), top_k))
+        if docs is not None:
+            logger.debug("Retrieval cache hit for query: %s", query)
+        return docs
+
+    def _fetch(self, query: str, top_k: int) -> List[Dict[str, Any]]:
         try:
-            result = (
-                self.client.query
-                .get("Document", ["content", "source"])
-                .with_bm25(query=query)
-                .with_limit(top_k)
-                .do()
-            )
-            return result["data"]["Get"]["Document"]
+            with STAGE_SECONDS.time("weaviate_search"):
+                docs = self._search(query, top_k)
+            if self.neighbor_chunks > 0 and docs:
+                with STAGE_SECONDS.time("weaviate_neighbors"):
+                    docs = self._expand_neighbors(docs)
         except Exception as e:
             logger.error(f"Error retrieving documents: {e}")
-            return []
\ No newline at end of file
+            return []
+        # Errors are not cached so a transient Weaviate failure does not stick
+        if self.cache is not None:
+            self.cache.set((normalize_query(query), top_k), docs)
+        return docs
+
+    def _search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        if self.mode == "bm25":
+            return self._query(top_k).with_bm25(query=query).do()["data"]["Get"]["Document"]
+        vector = self.embedder.embed([query])[0].tolist()
+        if self.mode == "vector":
+            return self._query(top_k).with_near_vector({"vector": vector}).do()["data"]["Get"]["Document"]
+        depth = max(top_k, self.candidates)
+        lexical = self._query(depth).with_bm25(query=query).do()["data"]["Get"]["Document"]
+        dense = self._query(depth).with_near_vector({"vector": vector}).do()["data"]["Get"]["Document"]
+        by_key = {}
+        rankings = []
+        for ranking in (lexical, dense):
+            keys = []
+            for doc in ranking:
+                key = (doc.get("source"), doc.get("chunk_index"))
+                by_key.setdefault(key, doc)
+                keys.append(key)
+            rankings.append(keys)
+        return [by_key[key] for key, _ in reciprocal_rank_fusion(rankings, k=self.rrf_k)[:top_k]]
+
+    def _query(self, limit: int):
+        return self.client.query.get("Document", PASSAGE_PROPERTIES).with_limit(limit)
+
+    def _expand_neighbors(self, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Replace each passage hit with itself plus up to neighbor_chunks passages on either side from the same source,
+        fetched in one query and merged in offset order. Hits already covered by a higher-ranked expansion are dropped.
+        """
+        n = self.neighbor_chunks
+        ranges = [hit for hit in hits if hit.get("chunk_index") is not None]
+        if not ranges:
+            return hits
+        where = {
+            "operator": "Or",
+            "operands": [
+                {
+                    "operator": "And",
+                    "operands": [
+                        {"path": ["source"], "operator": "Equal", "valueString": hit["source"]},
+                        {"path": ["chunk_index"], "operator": "GreaterThanEqual", "valueInt": hit["chunk_index"] - n},
+                        {"path": ["chunk_index"], "operator": "LessThanEqual", "valueInt": hit["chunk_index"] + n},
+                    ],
+                }
+                for hit in ranges
+            ],
+        }
+        result = self._query(len(ranges) * (2 * n + 1)).with_where(where).do()
+        by_position = {(p["source"], p["chunk_index"]): p for p in result["data"]["Get"]["Document"]}
+
+        expanded = []
+        covered = set()
+        for hit in hits:
+            index = hit.get("chunk_index")
+            if index is None:
+                expanded.append(hit)
+                continue
+            if (hit["source"], index) in covered:
+                continue
+            window = [hit] + [
+                by_position[(hit["source"], i)]
+                for i in range(index - n, index + n + 1)
+                if i != index and (hit["source"], i) in by_position and (hit["source"], i) not in covered
+            ]
+            covered.update((p["source"], p["chunk_index"]) for p in window)
+            expanded.append({**merge_passages(window), "chunk_index": index})
+        return expanded
+
+    def close(self):
+        """Shut down the retrieval thread pool, if one was started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def doc_list_size(docs: List[Dict[str, Any]]) -> int:
+    """Approximate in-memory size of a retrieval result, used to bound the retrieval cache by bytes."""
+    return sum(len(doc.get("content") or "") + len(doc.get("source") or "") for doc in docs)
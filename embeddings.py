@@ -0,0 +1,99 @@
+import logging
+import math
+import re
+import zlib
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# embeddings.py: Local CPU embedders used for dense and hybrid retrieval. Embedders are chosen by a spec string
+# (Config.EMBEDDER) that is stored next to the vectors, so queries are always embedded the same way as the corpus.
+#
+# An embedder has a `spec` string, a `dim` and an `embed(texts)` method returning an L2-normalised float32 matrix of
+# shape (len(texts), dim).
+
+_WORD = re.compile(r"\w+")
+
+# Very common English words carry no topical signal; they would dominate hashed vectors and match every passage in BM25
+STOPWORDS = frozenset(
+    "a an and are as at be been but by can do does for from has have how i if in into is it its me my no not of on "
+    "or our so than that the their them then there these they this to was we were what when where which who why will "
+    "with you your".split()
+)
+
+
+class HashingEmbedder:
+    """
+    Feature-hashing embedder: words and character trigrams are hashed into dim buckets with a random sign and
+    sublinear term weights. Needs no model files and no network, and is fast enough to embed at ingest time.
+
+    Trigrams let inflections and compounds ("install", "installing", "reinstall") land near each other; it does not
+    capture synonyms, for which a SentenceTransformerEmbedder with a local model is the better choice.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.spec = f"hashing:{dim}"
+
+    def _features(self, text: str) -> Counter:
+        features = Counter()
+        for word in _WORD.findall(text.lower()):
+            if word in STOPWORDS:
+                continue
+            features["w:" + word] += 1
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                features[padded[i:i + 3]] += 1
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * (1.0 + math.log(count))
+        return normalize_rows(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """
+    Embedder backed by a sentence-transformers model loaded from a local directory (needs `sentence-transformers`).
+    Runs on CPU and never downloads anything when given a path.
+    """
+
+    def __init__(self, model_path: str, batch_size: int = 32):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_path, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.spec = f"st:{model_path}"
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self._model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+        return normalize_rows(vectors.astype(np.float32, copy=False))
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length, so dot products are cosine similarities. Zero rows are left as they are."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.maximum(norms, 1e-12, out=norms)
+    return vectors / norms
+
+
+def load_embedder(spec: Optional[str], dim: int = 384):
+    """
+    Create an embedder from a spec string: "hashing" or "hashing:<dim>" for the HashingEmbedder, "st:<model dir>" for
+    a local sentence-transformers model. An empty spec disables embeddings and returns None.
+    """
+    if not spec:
+        return None
+    name, _, arg = spec.partition(":")
+    if name == "hashing":
+        return HashingEmbedder(int(arg) if arg else dim)
+    if name == "st":
+        return SentenceTransformerEmbedder(arg)
+    raise ValueError(f"Unknown embedder spec: {spec}")
@@ -1,56 +1,331 @@
+import json
 import logging
 import random
 import asyncio
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
 import aiohttp
 from aiohttp import ClientError
 
+from metrics import LLM_EJECTIONS, LLM_FAILURES, LLM_RETRIES, STAGE_SECONDS
+
 logger = logging.getLogger(__name__)
 
+# Longest ejection, as a multiple of the base ejection time, for a backend that keeps failing after re-admission
+_MAX_EJECTION_MULTIPLIER = 8
+
+
+class Backend:
+    """One OpenAI-compatible endpoint in a BackendPool, with its load and passive health state."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+
+class BackendPool:
+    """
+    Spread requests over several LLM servers. Each request goes to the backend with the fewest requests in flight
+    (ties rotate), so a slow or busy box receives less work without any active probing.
+
+    Health is tracked passively from real traffic: after max_failures consecutive failures a backend is ejected for
+    ejection_time seconds, doubling with each ejection in a row up to _MAX_EJECTION_MULTIPLIER times. When the time
+    is up it is re-admitted on probation; one success clears its record, one more failure ejects it again. If every
+    backend is ejected the one due back soonest is used anyway, rather than failing the request outright.
+
+    :param urls: Chat completion URLs of the backends
+    :param max_failures: Consecutive failures (connection errors, 5xx, 429) before a backend is ejected
+    :param ejection_time: Base seconds an ejected backend is kept out of rotation
+    """
+
+    def __init__(self, urls: Iterable[str], max_failures: int = 3, ejection_time: float = 30.0):
+        self.backends = [Backend(url) for url in dict.fromkeys(urls)]
+        if not self.backends:
+            raise ValueError("BackendPool needs at least one backend URL")
+        self.max_failures = max(max_failures, 1)
+        self.ejection_time = ejection_time
+        self._next = 0
+
+    def choose(self, exclude: Optional[Set[Backend]] = None) -> Backend:
+        """
+        Pick the least loaded available backend, avoiding those in exclude (the ones a request already tried) as long
+        as any other is available.
+        """
+        now = time.monotonic()
+        exclude = exclude or set()
+        candidates = [b for b in self.backends if b.available(now) and b not in exclude]
+        if not candidates:
+            candidates = [b for b in self.backends if b.available(now)]
+        if not candidates:
+            return min(self.backends, key=lambda b: b.ejected_until)
+        # Rotate the starting point so equally loaded backends take turns
+        start = self._next % len(self.backends)
+        self._next += 1
+        order = {b: (i - start) % len(self.backends) for i, b in enumerate(self.backends)}
+        return min(candidates, key=lambda b: (b.outstanding, order[b]))
+
+    @contextmanager
+    def track(self, backend: Backend):
+        """Count a request against backend for as long as it is in flight."""
+        backend.outstanding += 1
+        backend.requests += 1
+        try:
+            yield backend
+        finally:
+            backend.outstanding -= 1
+
+    def record_success(self, backend: Backend):
+        if backend.ejections:
+            logger.info(f"LLM backend {backend.url} recovered")
+        backend.consecutive_failures = 0
+        backend.ejections = 0
+
+    def record_failure(self, backend: Backend):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        LLM_FAILURES.inc(backend.url)
+        now = time.monotonic()
+        # Requests already in flight when the backend was ejected do not extend the ejection
+        if backend.consecutive_failures >= self.max_failures and backend.available(now):
+            multiplier = min(2 ** backend.ejections, _MAX_EJECTION_MULTIPLIER)
+            backend.ejections += 1
+            backend.ejected_until = now + self.ejection_time * multiplier
+            LLM_EJECTIONS.inc(backend.url)
+            logger.warning(
+                f"Ejecting LLM backend {backend.url} for {self.ejection_time * multiplier:g}s after "
+                f"{backend.consecutive_failures} consecutive failures"
+            )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "url": b.url,
+                "healthy": b.available(now),
+                "outstanding": b.outstanding,
+                "requests": b.requests,
+                "failures": b.failures,
+            }
+            for b in self.backends
+        ]
+
+
 class JanAIPromptNode:
-    def __init__(self, api_url: str, model_name: str, max_tokens=32000, max_retries: int = 3, base_delay: float = 1, api_key: str = None):
-        self.api_url = api_url
+    """
+    :param api_url: Chat completion URL, used when api_urls is not given
+    :param api_urls: Chat completion URLs of several interchangeable servers; requests are load balanced across them
+        and retries fail over to a different server (see BackendPool)
+    :param max_failures: Consecutive failures before a backend is taken out of rotation
+    :param ejection_time: Base seconds a failing backend stays out of rotation
+    :param request_timeout: Seconds a request to one backend may take in total (including reading a stream) before it
+        counts as a failure and is retried on another backend
+    """
+
+    def __init__(self, api_url: Optional[str], model_name: str, max_tokens=32000, max_retries: int = 3, base_delay: float = 1, api_key: str = None,
+                 pool_limit: int = 100, pool_limit_per_host: int = 20, keepalive_timeout: float = 30, dns_cache_ttl: int = 300,
+                 api_urls: Optional[List[str]] = None, max_failures: int = 3, ejection_time: float = 30,
+                 request_timeout: float = 120):
+        self.pool = BackendPool(api_urls or [api_url], max_failures=max_failures, ejection_time=ejection_time)
+        self.api_url = self.pool.backends[0].url
         self.model_name = model_name
         self.max_tokens = max_tokens
         self.max_retries = max_retries
         self.base_delay = base_delay
         self.api_key = api_key
+        # Connection pool settings for the long-lived session shared by all prompt calls
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.request_timeout = request_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
 
-    async def prompt(self, prompt_text: str) -> str:
+    async def open(self) -> aiohttp.ClientSession:
+        """
+        Open the pooled HTTP session if it is not already open. Must be called from a running event loop; prompt()
+        calls it lazily, but servers should call it at startup so the first request does not pay for it.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            )
+            logger.info(
+                f"Opened Jan.ai HTTP session (limit={self.pool_limit}, per_host={self.pool_limit_per_host}, "
+                f"keepalive={self.keepalive_timeout}s, timeout={self.request_timeout}s)"
+            )
+        return self._session
+
+    async def close(self):
+        """Close the pooled HTTP session and release its connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Closed Jan.ai HTTP session")
+        self._session = None
+
+    def _build_request(self, prompt_text: str, stream: bool):
         messages = [{"role": "user", "content": prompt_text}]
 
         payload = {
             "model": self.model_name,
             "messages": messages,
-            "stream": False
+            "stream": stream
         }
 
         headers = {}
         if self.api_key:
             headers["Authorization"] = f"Bearer {self.api_key}"
         headers["Content-Type"] = "application/json"
+        return payload, headers
+
+    async def prompt(self, prompt_text: str) -> str:
+        with STAGE_SECONDS.time("llm"):
+            return await self._prompt(prompt_text)
 
-        async with aiohttp.ClientSession() as session:
-            for attempt in range(self.max_retries):
-                try:
-                    async with session.post(self.api_url, json=payload, headers=headers) as response:
+    async def _prompt(self, prompt_text: str) -> str:
+        payload, headers = self._build_request(prompt_text, stream=False)
+
+        session = await self.open()
+        tried: Set[Backend] = set()
+        for attempt in range(self.max_retries):
+            backend = await self._next_backend(tried, attempt)
+            try:
+                with self.pool.track(backend):
+                    async with session.post(backend.url, json=payload, headers=headers) as response:
                         if response.status >= 400:
                             text = await response.text()
+                            self._record_status(backend, response.status)
                             logger.warning(
-                                f"Client error on attempt {attempt + 1}: {response.status} {response.reason}. Body: {text[:500]}"
+                                f"Client error on attempt {attempt + 1} ({backend.url}): {response.status} "
+                                f"{response.reason}. Body: {text[:500]}"
                             )
                         else:
                             result = await response.json()
+                            self.pool.record_success(backend)
                             return result['choices'][0]['message']['content']
-                except aiohttp.ClientError as e:
-                    logger.warning(f"Client error on attempt {attempt + 1}: {e}")
-                except Exception as e:
-                    logger.error(f"Unexpected error on attempt {attempt + 1}: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.pool.record_failure(backend)
+                logger.warning(f"Client error on attempt {attempt + 1} ({backend.url}): {e or type(e).__name__}")
+            except Exception as e:
+                logger.error(f"Unexpected error on attempt {attempt + 1}: {e}")
+                raise
+
+        logger.error(f"Failed to connect to Jan.ai API after {self.max_retries} attempts")
+        raise Exception("Failed to connect to Jan.ai API")
+
+    async def _next_backend(self, tried: Set[Backend], attempt: int) -> Backend:
+        """
+        Choose the backend for an attempt. A retry fails over to a backend this request has not tried yet without
+        waiting; only when it has to go back to one that already failed does it back off first.
+        """
+        if attempt > 0:
+            LLM_RETRIES.inc()
+        backend = self.pool.choose(exclude=tried)
+        if attempt > 0 and backend in tried:
+            delay = (2 ** (attempt - 1) + random.random()) * self.base_delay
+            logger.info("Retrying in %.2f seconds...", delay)
+            await asyncio.sleep(delay)
+            # Load and health may have changed while waiting
+            backend = self.pool.choose(exclude=tried)
+        elif attempt > 0:
+            logger.info("Failing over to %s", backend.url)
+        tried.add(backend)
+        return backend
+
+    def _record_status(self, backend: Backend, status: int):
+        # Overload and server errors count against the backend's health; other 4xx are the request's fault
+        if status >= 500 or status == 429:
+            self.pool.record_failure(backend)
+        else:
+            self.pool.record_success(backend)
+
+    async def prompt_stream(self, prompt_text: str) -> AsyncIterator[str]:
+        """
+        Stream the completion for prompt_text, yielding content deltas as the server produces them.
+
+        Failed attempts fail over to another backend like prompt(), but only until the first delta has been yielded;
+        after that an error is raised to the caller since the partial output cannot be taken back.
+        """
+        payload, headers = self._build_request(prompt_text, stream=True)
+
+        session = await self.open()
+        start = time.perf_counter()
+        tried: Set[Backend] = set()
+        for attempt in range(self.max_retries):
+            backend = await self._next_backend(tried, attempt)
+            started = False
+            try:
+                with self.pool.track(backend):
+                    async with session.post(backend.url, json=payload, headers=headers) as response:
+                        if response.status >= 400:
+                            text = await response.text()
+                            self._record_status(backend, response.status)
+                            logger.warning(
+                                f"Client error on attempt {attempt + 1} ({backend.url}): {response.status} "
+                                f"{response.reason}. Body: {text[:500]}"
+                            )
+                        elif response.content_type == "application/json":
+                            # Server ignored stream=True and answered in one piece
+                            result = await response.json()
+                            self.pool.record_success(backend)
+                            STAGE_SECONDS.observe(time.perf_counter() - start, "llm_first_token")
+                            yield result['choices'][0]['message']['content']
+                            return
+                        else:
+                            async for delta in self._iter_sse_deltas(response):
+                                if not started:
+                                    started = True
+                                    self.pool.record_success(backend)
+                                    STAGE_SECONDS.observe(time.perf_counter() - start, "llm_first_token")
+                                yield delta
+                            return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.pool.record_failure(backend)
+                if started:
+                    logger.error(f"Stream interrupted on attempt {attempt + 1} ({backend.url}): {e or type(e).__name__}")
                     raise
+                logger.warning(f"Client error on attempt {attempt + 1} ({backend.url}): {e or type(e).__name__}")
+            except Exception as e:
+                logger.error(f"Unexpected error on attempt {attempt + 1}: {e}")
+                raise
 
-                if attempt < self.max_retries - 1:
-                    delay = (2 ** attempt + random.random()) * self.base_delay
-                    logger.info(f"Retrying in {delay:.2f} seconds...")
-                    await asyncio.sleep(delay)
+        logger.error(f"Failed to connect to Jan.ai API after {self.max_retries} attempts")
+        raise Exception("Failed to connect to Jan.ai API")
 
-            logger.error(f"Failed to connect to Jan.ai API after {self.max_retries} attempts")
-            raise Exception("Failed to connect to Jan.ai API")
+    @staticmethod
+    async def _iter_sse_deltas(response: aiohttp.ClientResponse) -> AsyncIterator[str]:
+        # OpenAI-compatible servers send "data: {json}" events and finish with "data: [DONE]"
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed stream event: {data[:200]}")
+                continue
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
@@ -1,8 +1,49 @@
+import atexit
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from config import Config
+
+# Defaults per LOG_PROFILE. "production" logs at INFO through a background writer thread, so request handlers only
+# enqueue records and never wait on formatting, the console or the log file.
+PROFILES = {
+    "development": {"level": logging.DEBUG, "async": False},
+    "production": {"level": logging.INFO, "async": True},
+}
+
+_listener: Optional[QueueListener] = None
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread. The stock handler formats every record before
+    enqueueing it, which is exactly the work the queue is meant to move off the request path; records here stay in
+    the same process, so they can be passed on untouched.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(log_level=None, profile: Optional[str] = None, async_mode: Optional[bool] = None):
+    """
+    Configure the root logger with a rotating file (logs/app.log) and the console.
+
+    :param log_level: Level name or number; defaults to LOG_LEVEL, then to the profile's level
+    :param profile: "development" or "production"; defaults to LOG_PROFILE
+    :param async_mode: Write through a queue and a background thread; defaults to LOG_ASYNC, then to the profile
+    """
+    global _listener
+    settings = PROFILES.get((profile or Config.LOG_PROFILE).lower(), PROFILES["production"])
+    if log_level is None:
+        log_level = Config.LOG_LEVEL.upper() or settings["level"]
+    if async_mode is None:
+        async_mode = Config.LOG_ASYNC in ("1", "true", "yes") if Config.LOG_ASYNC else settings["async"]
 
-def setup_logging(log_level=logging.DEBUG):
     # Create logs directory if it doesn't exist
     if not os.path.exists('logs'):
         os.makedirs('logs')
@@ -11,7 +52,8 @@ def setup_logging(log_level=logging.DEBUG):
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
 
-    # Remove any existing handlers
+    # Remove any existing handlers, and stop the writer thread of a previous setup after it drains its queue
+    shutdown_logging()
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
 
@@ -28,6 +70,42 @@ def setup_logging(log_level=logging.DEBUG):
     console_handler.setLevel(log_level)
     console_handler.setFormatter(formatter)
 
-    # Add both handlers to the root logger
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
\ No newline at end of file
+    if not async_mode:
+        # Add both handlers to the root logger
+        root_logger.addHandler(file_handler)
+        root_logger.addHandler(console_handler)
+        return
+
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(_DeferredQueueHandler(log_queue))
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out queued records and stop the background writer, if async logging is on."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    atexit.unregister(shutdown_logging)
+
+
+def log_prompt(logger: logging.Logger, label: str, text: str):
+    """
+    Dump a prompt at DEBUG, for a LOG_PROMPT_SAMPLE_RATE share of calls and cut to LOG_PROMPT_MAX_CHARS. Costs one
+    level check when DEBUG is off.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if Config.LOG_PROMPT_SAMPLE_RATE < 1.0 and random.random() >= Config.LOG_PROMPT_SAMPLE_RATE:
+        return
+    limit = Config.LOG_PROMPT_MAX_CHARS
+    if 0 <= limit < len(text):
+        logger.debug("%s (%d chars, first %d):\n%s", label, len(text), limit, text[:limit])
+    else:
+        logger.debug("%s (%d chars):\n%s", label, len(text), text)
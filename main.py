@@ -15,6 +15,7 @@ async def main():
     rag_pipeline = RAGPipeline()  # Initialize the RAG pipeline
     try:
         rag_pipeline.initialize()
+        await rag_pipeline.start()
         logger.info("RAG pipeline initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize the RAG pipeline. Error: {e}", exc_info=True)
@@ -55,8 +56,8 @@ async def main():
             logger.error(f"Unexpected error in main loop: {e}", exc_info=True)
             print("\nAn error occurred while processing your query. Please try again.")
 
-    rag_pipeline.conversation_manager.summarize_old_conversations()
     rag_pipeline.conversation_manager.prune_old_conversations()
+    await rag_pipeline.shutdown()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
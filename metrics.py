@@ -0,0 +1,195 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# metrics.py: Minimal in-process metrics in the Prometheus text exposition format, served by api_server at /metrics.
+# Counters, gauges and histograms take at most one label, are safe to update from worker threads and cost a lock and a
+# dict update per observation. set_enabled(False) turns every update into a no-op.
+
+# Latency buckets in seconds, from a cached retrieval up to a slow LLM generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = True
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+
+def _format_labels(labelname: Optional[str], value: Optional[str], extra: str = "") -> str:
+    parts = []
+    if labelname is not None:
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{labelname}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelname: Optional[str] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelname = labelname
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelname: Optional[str] = None):
+        super().__init__(name, documentation, labelname)
+        self._values: Dict[Optional[str], float] = {}
+
+    def inc(self, label: Optional[str] = None, amount: float = 1.0):
+        if not _enabled:
+            return
+        with self._lock:
+            self._values[label] = self._values.get(label, 0.0) + amount
+
+    def value(self, label: Optional[str] = None) -> float:
+        return self._values.get(label, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: str(item[0]))
+        if not items and self.labelname is None:
+            items = [(None, 0.0)]
+        return [f"{self.name}{_format_labels(self.labelname, label)} {_format_value(v)}" for label, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, label: Optional[str] = None, amount: float = 1.0):
+        self.inc(label, -amount)
+
+    def set(self, value: float, label: Optional[str] = None):
+        if not _enabled:
+            return
+        with self._lock:
+            self._values[label] = value
+
+    @contextmanager
+    def track(self, label: Optional[str] = None):
+        """Count the body as in progress."""
+        self.inc(label)
+        try:
+            yield
+        finally:
+            self.dec(label)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelname: Optional[str] = None,
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelname)
+        self.buckets = tuple(sorted(buckets))
+        # Per label: bucket counts (non-cumulative, the last one for +Inf), sum, count
+        self._series: Dict[Optional[str], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, label: Optional[str] = None):
+        if not _enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            series[0][index] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    @contextmanager
+    def time(self, label: Optional[str] = None):
+        """Observe the wall-clock duration of the body, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label)
+
+    def count(self, label: Optional[str] = None) -> int:
+        series = self._series.get(label)
+        return series[1][1] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(label, list(counts), list(totals)) for label, (counts, totals) in self._series.items()]
+        lines = []
+        for label, counts, (total, count) in sorted(snapshot, key=lambda item: str(item[0])):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelname, label, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelname, label)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelname, label)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics rendered together. Collectors are callables invoked at scrape time that return
+    (name, kind, documentation, [(label_dict, value), ...]) tuples, for state other components already keep.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable):
+        self._collectors.append(collector)
+
+    def render(self, collectors: Iterable[Callable] = ()) -> str:
+        """Render all metrics and collectors, plus collectors passed for this scrape only."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        for collector in [*self._collectors, *collectors]:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if label_text
+                                 else f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Pipeline instrumentation shared by RAG_pipeline, jan_ai_service, document_retriever and conversation_manager
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_duration_seconds", "Time spent in each stage of answering a query", "stage"))
+QUERIES_IN_FLIGHT = REGISTRY.register(Gauge(
+    "rag_queries_in_flight", "Queries currently being answered by the pipeline"))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "rag_llm_retries_total", "LLM request attempts after the first one"))
+LLM_FAILURES = REGISTRY.register(Counter(
+    "rag_llm_failures_total", "Failed LLM request attempts by backend", "backend"))
+LLM_EJECTIONS = REGISTRY.register(Counter(
+    "rag_llm_backend_ejections_total", "LLM backends taken out of rotation after repeated failures", "backend"))
+TRUNCATIONS = REGISTRY.register(Counter(
+    "rag_truncation_events_total", "Prompt budget interventions by kind", "kind"))
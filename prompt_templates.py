@@ -1,5 +1,7 @@
 import logging
 
+from logging_config import log_prompt
+
 logger = logging.getLogger(__name__)
 
 TEMPLATES = {
@@ -28,24 +30,25 @@ TEMPLATES = {
     """,
 }
 
-def get_prompt(template_name, context, question, history):
-    template = TEMPLATES.get(template_name, TEMPLATES["default"])
-    logger.debug(f"Using template: {template_name}")
+def get_template(template_name):
+    return TEMPLATES.get(template_name, TEMPLATES["default"])
 
-    # logger.debug(f"Context (first 200 chars): {context[:200]}...")
-    # logger.debug(f"Question: {question}")
 
-    logger.debug("Conversation history:")
-    for msg in history:
-        logger.debug(f"  {msg['role']}: {msg['content'][:50]}...")  # Log first 50 chars of each message
+def get_prompt(template_name, context, question, history):
+    template = get_template(template_name)
+    logger.debug("Using template: %s", template_name)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Conversation history:")
+        for msg in history:
+            logger.debug("  %s: %s...", msg['role'], msg['content'][:50])  # Log first 50 chars of each message
 
     history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
 
     # Construct the full prompt
     full_prompt = template.format(context=context, question=question, history=history_str)
 
-    # Log the full prompt
-    logger.debug("Full prompt:")
-    logger.debug(full_prompt)
+    # Log the full prompt, capped and sampled (see LOG_PROMPT_*)
+    log_prompt(logger, "Full prompt", full_prompt)
 
     return full_prompt
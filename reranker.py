@@ -0,0 +1,99 @@
+import hashlib
+import logging
+from typing import Any, Dict, List
+
+import numpy as np
+
+from bm25_index import tokenize
+from cache import LRUCache
+from embeddings import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+# reranker.py: Post-retrieval stage. The pipeline over-fetches candidates, rescores them against the query with a
+# cheap local scorer, and picks the final passages with maximal marginal relevance (MMR) so near-duplicates do not
+# take several slots of the context budget.
+
+# Weights of the relevance signals: embedding similarity to the query, share of the query's terms a passage covers,
+# and the retriever's own rank
+SEMANTIC_WEIGHT = 0.5
+COVERAGE_WEIGHT = 0.3
+RANK_WEIGHT = 0.2
+
+
+def mmr_select(relevance: np.ndarray, similarity: np.ndarray, top_k: int, mmr_lambda: float = 0.7,
+               duplicate_threshold: float = 0.9) -> List[int]:
+    """
+    Greedy maximal marginal relevance: repeatedly take the candidate with the best
+    mmr_lambda * relevance - (1 - mmr_lambda) * (highest similarity to anything already taken).
+    Candidates at least duplicate_threshold similar to a taken one are dropped, so fewer than top_k may be returned.
+
+    :param relevance: Relevance of each candidate, in [0, 1]
+    :param similarity: Pairwise candidate similarity matrix
+    :return: Indices of the selected candidates, in selection order
+    """
+    count = len(relevance)
+    selected = []
+    redundancy = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    while len(selected) < top_k and available.any():
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+        available &= redundancy < duplicate_threshold
+    return selected
+
+
+class Reranker:
+    """
+    Rescore retrieved passages for a query and select a diverse subset.
+
+    :param embedder: Embedder used for query/passage and passage/passage similarity (see embeddings.py)
+    :param mmr_lambda: Trade-off between relevance (1.0) and diversity (0.0)
+    :param duplicate_threshold: Cosine similarity at which a passage counts as a duplicate of a selected one
+    :param cache_size: Passage embeddings memoized by content, so repeated hits are not embedded again
+    """
+
+    def __init__(self, embedder, mmr_lambda: float = 0.7, duplicate_threshold: float = 0.9, cache_size: int = 4096):
+        self.embedder = embedder
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self._vectors = LRUCache(max_entries=cache_size)
+
+    def rerank(self, query: str, docs: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """Return at most top_k of docs, most relevant first, without near-duplicates."""
+        if len(docs) <= 1:
+            return docs[:top_k]
+        texts = [doc.get("content") or "" for doc in docs]
+        vectors = self._embed(texts)
+        semantic = np.clip(vectors @ self.embedder.embed([query])[0], 0.0, None)
+        prior = 1.0 - np.arange(len(docs), dtype=np.float32) / len(docs)
+        relevance = SEMANTIC_WEIGHT * semantic + COVERAGE_WEIGHT * self._coverage(query, texts) + RANK_WEIGHT * prior
+        relevance /= max(float(relevance.max()), 1e-12)
+        selected = mmr_select(relevance, vectors @ vectors.T, top_k, self.mmr_lambda, self.duplicate_threshold)
+        if len(selected) < min(top_k, len(docs)):
+            logger.debug("Reranker dropped %d near-duplicate passages", len(docs) - len(selected))
+        return [docs[i] for i in selected]
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        keys = [hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest() for text in texts]
+        rows = [self._vectors.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            for i, row in zip(missing, self.embedder.embed([texts[i] for i in missing])):
+                rows[i] = row
+                self._vectors.set(keys[i], row)
+        return np.stack(rows)
+
+    @staticmethod
+    def _coverage(query: str, texts: List[str]) -> np.ndarray:
+        """IDF-weighted share of the query's terms present in each text, with IDF taken over the candidates."""
+        terms = sorted(set(tokenize(query)) - STOPWORDS)
+        if not terms:
+            return np.zeros(len(texts), dtype=np.float32)
+        present = np.array([[term in words for term in terms] for words in map(set, map(tokenize, texts))],
+                           dtype=np.float32)
+        idf = np.log1p(len(texts) / (1.0 + present.sum(axis=0)))
+        return present @ idf / idf.sum()
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+logger = logging.getLogger(__name__)
+
+# scheduler.py: Admission control in front of the LLM backend. At most max_concurrent generations run at once;
+# further requests wait in a bounded FIFO queue, and requests beyond that are turned away immediately so the API can
+# answer 503 with Retry-After instead of piling more work on an overloaded inference server. Requests for the same
+# session run one at a time in arrival order; requests waiting behind their session count against the same queue
+# bound and timeout, and are answered 429 when they exceed them.
+
+# Queue waits kept for the percentile stats
+_WAIT_SAMPLES = 1024
+
+
+class Rejected(Exception):
+    """A request turned away by the scheduler; status_code is the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class GenerationScheduler:
+    """
+    :param max_concurrent: Generations allowed to run at once
+    :param max_queue: Requests allowed to wait for a slot or for their session; more are rejected with 503 (429 when
+                      waiting for the session)
+    :param queue_timeout: Seconds a request may wait for a slot (or for its session) before it is rejected with 503
+                          (429)
+    :param retry_after: Seconds suggested to rejected clients in the Retry-After header
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32, queue_timeout: float = 30.0,
+                 retry_after: int = 5):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._running = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Sessions with a request in progress, each with the FIFO of requests waiting for it
+        self._sessions: Dict[str, Deque[asyncio.Future]] = {}
+        self._session_waiting = 0
+        self._waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_session_busy = 0
+        self.timeouts = 0
+
+    # --- per-session fairness -------------------------------------------------------------------------------------
+
+    def _queued(self) -> int:
+        return len(self._waiters) + self._session_waiting
+
+    def check(self, session_id: str):
+        """Raise Rejected if a request for session_id would be turned away right now. Does not reserve anything."""
+        if session_id in self._sessions:
+            if self._queued() >= self.max_queue:
+                self.rejected_session_busy += 1
+                raise Rejected(429, "Too many requests waiting for this session", self.retry_after)
+            return
+        has_free_slot = self._running < self.max_concurrent and not self._waiters
+        if not has_free_slot and self._queued() >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Rejected(503, "Server is busy, please retry later", self.retry_after)
+
+    @asynccontextmanager
+    async def session(self, session_id: str):
+        """
+        Hold session_id for the duration of a request. Concurrent requests for the same session wait their turn in
+        arrival order; the wait is rejected with 429 if the queue is full or it exceeds queue_timeout.
+        """
+        await self._acquire_session(session_id)
+        try:
+            yield
+        finally:
+            self._release_session(session_id)
+
+    async def _acquire_session(self, session_id: str):
+        waiters = self._sessions.get(session_id)
+        if waiters is None:
+            self._sessions[session_id] = deque()
+            return
+        if self._queued() >= self.max_queue:
+            self.rejected_session_busy += 1
+            raise Rejected(429, "Too many requests waiting for this session", self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        self._session_waiting += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The session was handed over just as the wait ended; pass it on
+                self._release_session(session_id)
+            else:
+                try:
+                    waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timeouts += 1
+            raise Rejected(429, "Timed out waiting for an earlier request of this session", self.retry_after) from None
+        finally:
+            self._session_waiting -= 1
+
+    def _release_session(self, session_id: str):
+        """Hand session_id to its longest-waiting request, or free it if none is waiting."""
+        waiters = self._sessions[session_id]
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        del self._sessions[session_id]
+
+    # --- generation slots -----------------------------------------------------------------------------------------
+
+    async def acquire(self):
+        """Wait for a generation slot. Raises Rejected (503) if the queue is full or the wait exceeds queue_timeout."""
+        if self._running < self.max_concurrent and not self._waiters:
+            self._running += 1
+            self._admit(0.0)
+            return
+        if self._queued() >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Rejected(503, "Server is busy, please retry later", self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended; pass it on
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timeouts += 1
+            raise Rejected(503, "Timed out waiting for a free generation slot", self.retry_after) from None
+        self._admit(time.monotonic() - start)
+
+    def release(self):
+        """Free a slot, handing it straight to the longest-waiting request if there is one."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._running -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() in a generation slot."""
+        async with self.slot():
+            return await fn()
+
+    def _admit(self, waited: float):
+        self.admitted += 1
+        self._waits.append(waited)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return round(waits[min(int(p * len(waits)), len(waits) - 1)], 4) if waits else 0.0
+
+        return {
+            "running": self._running,
+            "queued": len(self._waiters),
+            "active_sessions": len(self._sessions),
+            "session_queued": self._session_waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_session_busy": self.rejected_session_busy,
+            "timeouts": self.timeouts,
+            "queue_wait_p50": percentile(0.50),
+            "queue_wait_p95": percentile(0.95),
+            "queue_wait_max": round(waits[-1], 4) if waits else 0.0,
+        }
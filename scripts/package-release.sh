@@ -17,7 +17,7 @@ zip -r "$OUTDIR/${NAME}.zip" . \
   -x "web/.next/*" \
   -x ".git/*" \
   -x "logs/*" \
-  -x "conversations.db" \
+  -x "conversations.db*" \
   -x ".DS_Store" \
   -x "**/.DS_Store"
 
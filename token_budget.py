@@ -0,0 +1,135 @@
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Any
+
+# token_budget.py: Splits the prompt token budget between template, query, history and retrieved context, and fills
+# each share in a single pass from precomputed token counts, cutting text on paragraph or sentence boundaries.
+
+# Upper bound on characters per token, used to slice huge documents before counting so counting stays cheap
+MAX_CHARS_PER_TOKEN = 8
+
+# Separators tried, in order of preference, when cutting text to fit a budget
+_BOUNDARIES = ("\n\n", "\n", ". ", "! ", "? ", "; ")
+
+
+class TokenBudget(NamedTuple):
+    template: int
+    query: int
+    history: int
+    context: int
+
+
+def allocate_budget(max_tokens: int, template_tokens: int, query_tokens: int, history_share: float) -> TokenBudget:
+    """
+    Reserve the template and query as measured, then split what is left between history and context.
+
+    :param max_tokens: Total prompt budget
+    :param template_tokens: Tokens used by the prompt template itself
+    :param query_tokens: Tokens used by the user query
+    :param history_share: Fraction of the remaining budget reserved for conversation history
+    """
+    remaining = max(max_tokens - template_tokens - query_tokens, 0)
+    history = int(remaining * history_share)
+    return TokenBudget(template=template_tokens, query=query_tokens, history=history, context=remaining - history)
+
+
+def cut_at_boundary(text: str, max_chars: int) -> str:
+    """Return the longest prefix of text up to max_chars that ends on a paragraph, sentence or word boundary."""
+    if len(text) <= max_chars:
+        return text
+    prefix = text[:max_chars]
+    for sep in _BOUNDARIES:
+        pos = prefix.rfind(sep)
+        # Only accept a boundary that keeps at least half of the allowed text
+        if pos >= max_chars // 2:
+            return prefix[:pos + len(sep.rstrip())].rstrip()
+    pos = prefix.rfind(" ")
+    return prefix[:pos] if pos > 0 else prefix
+
+
+def fit_text(text: str, max_tokens: int, count_tokens: Callable[[str], int], tokens: int = None) -> Tuple[str, int]:
+    """
+    Cut text to at most max_tokens, keeping its head and ending on a natural boundary.
+
+    :param tokens: Token count of text, if already known
+    :return: (text, token_count)
+    """
+    if tokens is None:
+        tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, tokens
+    if max_tokens <= 0 or not text:
+        return "", 0
+    # Scale by the text's own chars-per-token ratio; retry a couple of times for tokenizers that are not linear
+    max_chars = len(text) * max_tokens // tokens
+    for _ in range(3):
+        cut = cut_at_boundary(text, max_chars)
+        cut_tokens = count_tokens(cut)
+        if cut_tokens <= max_tokens:
+            return cut, cut_tokens
+        max_chars = len(cut) * max_tokens // max(cut_tokens, 1) - 1
+        if max_chars <= 0:
+            break
+    return "", 0
+
+
+def build_context(docs: List[Dict[str, Any]], budget: int, count_tokens: Callable[[str], int],
+                  max_doc_tokens: int, count_tokens_batch: Optional[Callable[[List[str]], List[int]]] = None
+                  ) -> Tuple[str, int]:
+    """
+    Render retrieved documents into the context block within budget tokens.
+
+    Each document gets at most max_doc_tokens. Documents smaller than their fair share give the remainder to the
+    others (water-filling over the per-document counts), and documents that do not fit whole keep their head, cut on
+    a boundary, so the top hits are never reduced to their middle.
+
+    :param count_tokens_batch: Optional batch counter used for the per-document counts
+    :return: (context, token_count)
+    """
+    if not docs or budget <= 0:
+        return "", 0
+    slice_chars = max_doc_tokens * MAX_CHARS_PER_TOKEN
+    entries = [
+        f"Document {i + 1} ({doc.get('source', 'unknown')}): {(doc.get('content') or '')[:slice_chars]}"
+        for i, doc in enumerate(docs)
+    ]
+    counts = count_tokens_batch(entries) if count_tokens_batch else [count_tokens(entry) for entry in entries]
+
+    allocation = [0] * len(entries)
+    remaining = budget
+    order = sorted(range(len(entries)), key=lambda i: counts[i])
+    for rank, i in enumerate(order):
+        share = remaining // (len(entries) - rank)
+        allocation[i] = min(counts[i], share, max_doc_tokens)
+        remaining -= allocation[i]
+
+    parts = []
+    used = 0
+    for entry, tokens, allowed in zip(entries, counts, allocation):
+        text, text_tokens = fit_text(entry, allowed, count_tokens, tokens=tokens)
+        if text:
+            parts.append(text)
+            used += text_tokens
+    return "\n".join(parts), used
+
+
+def fit_history(messages: List[Dict[str, Any]], counts: List[int], budget: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Keep the newest messages that fit in budget. A leading summary message (role "system") is kept first when it fits,
+    since it stands in for everything older.
+
+    :param counts: Token count of each message, aligned with messages
+    :return: (kept_messages, token_count)
+    """
+    start = 0
+    used = 0
+    head = []
+    if messages and messages[0]['role'] == "system" and counts[0] <= budget:
+        head = [messages[0]]
+        used = counts[0]
+        start = 1
+    kept = []
+    for msg, tokens in zip(reversed(messages[start:]), reversed(counts[start:])):
+        if used + tokens > budget:
+            break
+        kept.append(msg)
+        used += tokens
+    return head + kept[::-1], used
@@ -1,26 +1,94 @@
 # tokenizer.py
+import hashlib
+import logging
+from typing import List, Optional
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Strings longer than this are memoized under a digest instead of the string itself, so the cache does not pin large
+# documents in memory
+_MAX_INLINE_KEY_CHARS = 1024
+
+
+class HuggingFaceBackend:
+    """BPE/WordPiece/Unigram tokenizer loaded from a local Hugging Face `tokenizer.json` (needs `tokenizers`)."""
+
+    def __init__(self, path: str):
+        from tokenizers import Tokenizer as HFTokenizer
+        self._tokenizer = HFTokenizer.from_file(path)
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        return [len(encoding.ids) for encoding in self._tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+class SentencePieceBackend:
+    """SentencePiece model loaded from a local `.model` file (needs `sentencepiece`)."""
+
+    def __init__(self, path: str):
+        import sentencepiece as spm
+        self._processor = spm.SentencePieceProcessor(model_file=path)
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        return [len(ids) for ids in self._processor.encode(texts)]
+
+
+def load_tokenizer_backend(path: str):
+    """
+    Load a tokenizer backend from a local vocab file, chosen by extension: `.model` for SentencePiece, anything else
+    (typically `tokenizer.json`) for Hugging Face tokenizers. Never touches the network.
+    """
+    if path.endswith(".model"):
+        return SentencePieceBackend(path)
+    return HuggingFaceBackend(path)
+
 
 class Tokenizer:
-    def __init__(self):
-        # Placeholder for future custom tokenizer implementation
+    def __init__(self, vocab_path: Optional[str] = None, cache_size: int = 8192):
+        # Backend with a count_batch(texts) method; None means the len(text)//4 estimate is used
         self.custom_tokenizer = None
+        # Token counts for repeated strings (template text, history messages, documents)
+        self._cache = LRUCache(max_entries=cache_size)
+        if vocab_path:
+            try:
+                self.set_custom_tokenizer(load_tokenizer_backend(vocab_path))
+                logger.info(f"Loaded tokenizer vocab from {vocab_path}")
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer vocab from {vocab_path} ({e}); using estimation")
 
     def count_tokens(self, text):
-        # Simple estimation: assume 1 token is roughly 4 characters
-        return len(text) // 4
+        if self.custom_tokenizer is None:
+            return self.estimate_tokens(text)
+        return self.count_tokens_batch([text])[0]
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for many strings at once; only strings not already memoized are sent to the backend."""
+        if self.custom_tokenizer is None:
+            return [self.estimate_tokens(text) for text in texts]
+        keys = [self._cache_key(text) for text in texts]
+        counts = [self._cache.get(key) for key in keys]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            for i, count in zip(missing, self.custom_tokenizer.count_batch([texts[i] for i in missing])):
+                counts[i] = count
+                self._cache.set(keys[i], count)
+        return counts
 
     def estimate_tokens(self, text):
-        # Alias for count_tokens to make it clear this is an estimation
-        return self.count_tokens(text)
+        # Simple estimation: assume 1 token is roughly 4 characters
+        return len(text) // 4
 
-    # Placeholder method for future implementation of a more accurate tokenizer
     def set_custom_tokenizer(self, tokenizer):
         self.custom_tokenizer = tokenizer
-        print("Custom tokenizer set. Note: Not implemented yet.")
+        self._cache.clear()
 
-    # Placeholder method to use the custom tokenizer once implemented
     def count_tokens_accurately(self, text):
-        if self.custom_tokenizer:
-            # This is where we would use the custom tokenizer
-            print("Custom tokenizer not implemented yet. Using estimation.")
-        return self.count_tokens(text)
\ No newline at end of file
+        # Kept for callers that want to be explicit; count_tokens already uses the custom tokenizer when one is set
+        return self.count_tokens(text)
+
+    @staticmethod
+    def _cache_key(text):
+        if len(text) <= _MAX_INLINE_KEY_CHARS:
+            return text
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# vector_index.py: Local vector index over passage embeddings, stored as one contiguous float32 matrix on disk and
+# searched with NumPy. Small corpora are searched exhaustively; larger ones get an IVF index (k-means centroids plus
+# an inverted list of passage ids per centroid) so a query only scores the passages in its nearest lists.
+#
+# Files, written into the same directory as the passages they describe:
+#   vectors.f32        float32[N, dim], row i is the embedding of passage i
+#   vector_meta.json   count, dim, embedder spec and IVF parameters
+#   ivf_centroids.npy  float32[nlist, dim]
+#   ivf_ptr.npy        int64[nlist+1], CSR pointers into ivf_ids
+#   ivf_ids.npy        int32, passage ids grouped by nearest centroid
+
+# Rows assigned to centroids per step while building, to bound temporary memory
+_ASSIGN_CHUNK = 65536
+
+
+class VectorIndexWriter:
+    """Embed passages in batches as they are added and append the vectors to vectors.f32 in directory path."""
+
+    def __init__(self, path: str, embedder, batch_size: int = 64):
+        self.path = path
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.count = 0
+        self._pending: List[str] = []
+        self._file = open(os.path.join(path, "vectors.f32"), "wb")
+
+    def add(self, text: str):
+        self._pending.append(text)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self.embedder.embed(self._pending).astype(np.float32, copy=False).tofile(self._file)
+            self.count += len(self._pending)
+            self._pending = []
+
+    def finish(self, ivf_min_vectors: int = 50000):
+        """Write the remaining vectors and the metadata, and build IVF lists once there are ivf_min_vectors rows."""
+        self._flush()
+        self._file.close()
+        meta = {"count": self.count, "dim": self.embedder.dim, "embedder": self.embedder.spec, "nlist": 0}
+        if self.count >= ivf_min_vectors:
+            vectors = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="r",
+                                shape=(self.count, self.embedder.dim))
+            meta["nlist"] = build_ivf(vectors, self.path)
+        with open(os.path.join(self.path, "vector_meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=1)
+
+    def abort(self):
+        self._file.close()
+
+
+def build_ivf(vectors: np.ndarray, path: str, nlist: Optional[int] = None, iterations: int = 10, seed: int = 0) -> int:
+    """
+    Cluster unit vectors with spherical k-means (trained on a sample) and write the IVF files to path.
+
+    :param nlist: Number of lists; defaults to about sqrt(N)
+    :return: Number of lists written
+    """
+    count = len(vectors)
+    nlist = nlist or max(1, int(np.sqrt(count)))
+    rng = np.random.default_rng(seed)
+    sample_size = min(count, nlist * 64)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        sizes = np.bincount(assign, minlength=nlist)
+        empty = sizes == 0
+        # Re-seed empty lists with random sample rows so every list stays in use
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+    assign = np.empty(count, dtype=np.int32)
+    for start in range(0, count, _ASSIGN_CHUNK):
+        block = np.asarray(vectors[start:start + _ASSIGN_CHUNK])
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    ids = np.argsort(assign, kind="stable").astype(np.int32)
+    ptr = np.zeros(nlist + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+
+    np.save(os.path.join(path, "ivf_centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(path, "ivf_ptr.npy"), ptr)
+    np.save(os.path.join(path, "ivf_ids.npy"), ids)
+    logger.info(f"Built IVF index with {nlist} lists over {count} vectors")
+    return nlist
+
+
+class VectorIndex:
+    """
+    Read-only, memory-mapped view of the vectors in directory path.
+
+    :param nprobe: IVF lists scanned per query (ignored for exhaustive search)
+    """
+
+    def __init__(self, path: str, nprobe: int = 8):
+        with open(os.path.join(path, "vector_meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.count = meta["count"]
+        self.dim = meta["dim"]
+        self.embedder_spec = meta["embedder"]
+        self.nprobe = nprobe
+        self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r",
+                                 shape=(self.count, self.dim)) if self.count else np.zeros((0, self.dim), np.float32)
+        self.centroids = None
+        if meta.get("nlist"):
+            self.centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+            self.ivf_ptr = np.load(os.path.join(path, "ivf_ptr.npy"), mmap_mode="r")
+            self.ivf_ids = np.load(os.path.join(path, "ivf_ids.npy"), mmap_mode="r")
+
+    def search(self, query_vector: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Return up to top_k (passage id, cosine similarity) pairs, best first."""
+        if top_k <= 0 or not self.count:
+            return []
+        if self.centroids is None:
+            candidates = None
+            scores = self.vectors @ query_vector
+        else:
+            nprobe = min(self.nprobe, len(self.centroids))
+            lists = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+            # Sorted ids read the memory-mapped matrix front to back
+            candidates = np.sort(np.concatenate([self.ivf_ids[self.ivf_ptr[i]:self.ivf_ptr[i + 1]] for i in lists]))
+            scores = self.vectors[candidates] @ query_vector
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        ids = best if candidates is None else candidates[best]
+        return [(int(doc_id), float(score)) for doc_id, score in zip(ids, scores[best])]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = 60) -> List[Tuple[Hashable, float]]:
+    """
+    Fuse ranked lists by reciprocal rank: each item scores sum(1 / (k + rank)) over the lists it appears in. Only
+    ranks are used, so lists with incomparable scores (BM25 and cosine) combine without normalisation.
+
+    :return: (item, fused score) pairs, best first; ties keep the order in which items were first seen
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: -pair[1])
@@ -1,9 +1,26 @@
 import weaviate
 from pathlib import Path
+import argparse
+import hashlib
+import json
 import logging
-from typing import List, Dict
+import mmap
+import queue
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import os
+import sys
+import time
 from dotenv import load_dotenv
+from weaviate.util import generate_uuid5
+
+# Make the application modules at the repo root importable when run as `python weaviate/populate_weaviate_store.py`
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from bm25_index import build_index, read_index_signature
+from cache import bump_corpus_version
+from chunking import chunk_document
+from config import Config
+from embeddings import load_embedder
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,88 +29,9 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Leading bytes checked for NUL bytes to recognise binary files before reading the rest
+BINARY_SNIFF_BYTES = 8192
 
-def document_exists(client: weaviate.Client, source: str) -> bool:
-    try:
-        query = (
-            client.query
-            .get("Document", ["source"])
-            .with_where({
-                "path": ["source"],
-                "operator": "Equal",
-                "valueString": source
-            })
-            .do()
-        )
-
-        logger.debug(f"Query response for document_exists: {query}")
-
-        if 'data' not in query:
-            logger.error(f"Unexpected query response structure: {query}")
-            return False
-
-        if 'Get' not in query['data']:
-            logger.error(f"'Get' not found in query response data: {query['data']}")
-            return False
-
-        if 'Document' not in query['data']['Get']:
-            logger.error(f"'Document' not found in Get data: {query['data']['Get']}")
-            return False
-
-        return len(query['data']['Get']['Document']) > 0
-    except Exception as e:
-        logger.error(f"Error checking if document exists: {str(e)}")
-        logger.exception("Full traceback:")
-        return False
-
-
-def update_document(client: weaviate.Client, source: str, content: str) -> None:
-    try:
-        query = (
-            client.query
-            .get("Document", ["source"])  # we request id via _additional
-            .with_additional(["id"])  # GraphQL _additional { id }
-            .with_where({
-                "path": ["source"],
-                "operator": "Equal",
-                "valueString": source
-            })
-            .do()
-        )
-
-        logger.debug(f"Query response for update: {query}")
-
-        if 'data' not in query:
-            logger.error(f"Unexpected query response structure: {query}")
-            return
-
-        if 'Get' not in query['data']:
-            logger.error(f"'Get' not found in query response data: {query['data']}")
-            return
-
-        if 'Document' not in query['data']['Get']:
-            logger.error(f"'Document' not found in Get data: {query['data']['Get']}")
-            return
-
-        documents = query['data']['Get']['Document']
-
-        if not documents:
-            logger.warning(f"No document found with source: {source}")
-            return
-
-        doc_id = documents[0]['_additional']['id']
-        client.data_object.update(
-            uuid=doc_id,
-            class_name="Document",
-            data_object={
-                "content": content,
-                "source": source
-            }
-        )
-        logger.info(f"Updated document: {source}")
-    except Exception as e:
-        logger.error(f"Error updating document {source}: {str(e)}")
-        logger.exception("Full traceback:")
 
 def create_schema(client: weaviate.Client) -> None:
     """
@@ -101,140 +39,627 @@ def create_schema(client: weaviate.Client) -> None:
 
     :param client: Weaviate client instance
     """
+    properties = [
+        {"name": "content", "dataType": ["text"]},
+        {"name": "source", "dataType": ["string"]},
+        # Passage position within the source file (see chunking.py)
+        {"name": "chunk_index", "dataType": ["int"]},
+        {"name": "start_offset", "dataType": ["int"]},
+        {"name": "end_offset", "dataType": ["int"]},
+    ]
     schema = client.schema.get()
-    if "Document" not in [class_obj["class"] for class_obj in schema["classes"]]:
+    existing = {class_obj["class"]: class_obj for class_obj in schema["classes"]}
+    if "Document" not in existing:
         class_obj = {
             "class": "Document",
-            "properties": [
-                {"name": "content", "dataType": ["text"]},
-                {"name": "source", "dataType": ["string"]}
-            ]
+            "properties": properties
         }
         client.schema.create_class(class_obj)
         logger.info("Created 'Document' schema in Weaviate.")
+        return
+    # Schemas created before passage chunking lack the position properties
+    present = {prop["name"] for prop in existing["Document"].get("properties", [])}
+    for prop in properties:
+        if prop["name"] not in present:
+            client.schema.property.create("Document", prop)
+            logger.info(f"Added '{prop['name']}' property to 'Document' schema.")
 
 
-def read_documents(documents_dir: str) -> List[Dict[str, str]]:
+def load_manifest(manifest_path: str, weaviate_url: str, embedder: Optional[str] = None) -> Dict[str, Dict]:
     """
-    Read documents from the specified directory.
+    Load the ingestion manifest: one entry per source with the file's size, mtime, content hash and passage ids.
+    A missing or unreadable manifest, or one written for a different Weaviate instance or embedder, yields an empty
+    manifest.
+    """
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+    if manifest.get("weaviate_url") != weaviate_url:
+        logger.info("Manifest was written for a different Weaviate instance; running a full sync")
+        return {}
+    if manifest.get("embedder") != embedder:
+        # Stored vectors would not match the ones computed for queries
+        logger.info("Manifest was written with a different embedder; running a full sync")
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(manifest_path: str, weaviate_url: str, files: Dict[str, Dict],
+                  embedder: Optional[str] = None) -> None:
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"weaviate_url": weaviate_url, "embedder": embedder, "files": files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def iter_document_files(documents_dir: str, include: Sequence[str] = ("*",), exclude: Sequence[str] = (),
+                        recursive: bool = False) -> Iterator[Tuple[str, Path]]:
+    """
+    Yield (source, path) for files under documents_dir, where source is the path relative to documents_dir in posix
+    form. Files are kept if they match any include pattern and no exclude pattern; patterns are matched against the
+    relative path from the right, so "*.md" matches at any depth. Hidden directories are not descended into.
+    """
+    root = Path(documents_dir)
+    if not root.is_dir():
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        if recursive:
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        else:
+            dirnames[:] = []
+        for filename in sorted(filenames):
+            path = Path(dirpath) / filename
+            relative = path.relative_to(root)
+            if not any(relative.match(pattern) for pattern in include):
+                continue
+            if any(relative.match(pattern) for pattern in exclude):
+                continue
+            if path.is_file():
+                yield relative.as_posix(), path
+
+
+def read_text_file(path: Path, size: int, expected_sha256: Optional[str] = None,
+                   mmap_threshold: int = 16 * 1024 * 1024) -> Tuple[Optional[str], str]:
+    """
+    Hash a file and decode it as UTF-8. Files of at least mmap_threshold bytes are memory-mapped, so they are hashed
+    and decoded straight from the page cache without an intermediate bytes copy.
 
-    :param documents_dir: Path to the directory containing documents
-    :return: List of dictionaries containing document content and source
+    :param expected_sha256: Known hash of the file; when it matches, decoding is skipped and content is None
+    :return: (content, sha256)
+    :raises ValueError: For binary files (NUL bytes near the start) and files that are not valid UTF-8
+    """
+    with open(path, 'rb') as f:
+        if size >= mmap_threshold:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _decode_text(data, expected_sha256)
+        head = f.read(BINARY_SNIFF_BYTES)
+        if b"\0" in head:
+            raise ValueError("binary file")
+        return _decode_text(head + f.read(), expected_sha256)
+
+
+def _decode_text(data, expected_sha256: Optional[str]) -> Tuple[Optional[str], str]:
+    if b"\0" in data[:BINARY_SNIFF_BYTES]:
+        raise ValueError("binary file")
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == expected_sha256:
+        return None, digest
+    # Match text-mode reads, which translate Windows line endings
+    content = str(data, 'utf-8').replace('\r\n', '\n')
+    return content, digest
+
+
+def scan_documents(documents_dir: str, manifest: Dict[str, Dict], files: Dict[str, Dict], full: bool = False,
+                   include: Sequence[str] = ("*",), exclude: Sequence[str] = (), recursive: bool = False,
+                   mmap_threshold: int = 16 * 1024 * 1024) -> Iterator[Tuple[Dict[str, str], Dict]]:
+    """
+    Compare the documents directory against the manifest, one file at a time. Files whose size and mtime match their
+    entry are skipped without being read; other files are hashed, and only those whose content changed are decoded
+    and yielded for upload. With full=True every readable file is yielded. Binary and non-UTF-8 files are skipped.
+
+    :param files: Filled in with the manifest entries of unchanged files (and of unreadable files, so their passages
+                  stay tracked)
+    :return: Generator of (document, entry) pairs for new or modified files; the caller adds passage ids to the entry
+             and stores it once uploaded
     """
-    documents = []
-    for file_path in Path(documents_dir).glob('*'):
-        if file_path.is_file():
+    for source, file_path in iter_document_files(documents_dir, include, exclude, recursive):
+        entry = None if full else manifest.get(source)
+        try:
+            stat = file_path.stat()
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                files[source] = entry
+                continue
+            content, digest = read_text_file(
+                file_path, stat.st_size, entry["sha256"] if entry else None, mmap_threshold=mmap_threshold
+            )
+        except ValueError as e:
+            logger.info(f"Skipping {file_path}: not a UTF-8 text file ({e})")
+            continue
+        except OSError as e:
+            logger.error(f"Error reading file {file_path}: {e}")
+            if source in manifest:
+                files[source] = manifest[source]
+            continue
+        new_entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        if content is None:
+            # Touched but not modified
+            files[source] = {**new_entry, "ids": entry_ids(entry)}
+            continue
+        yield {"content": content, "source": source}, new_entry
+
+
+def prefetch(items: Iterable, maxsize: int) -> Iterator:
+    """
+    Produce items on a background thread while the caller consumes them, holding at most maxsize items in between.
+    Reading and chunking files then overlaps with uploading, and memory stays bounded by the queue, not the corpus.
+    Exceptions raised by the producer are re-raised in the consumer.
+    """
+    buffer: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=max(maxsize, 1))
+    stop = threading.Event()
+
+    def put(kind: str, value: Any) -> bool:
+        while not stop.is_set():
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    documents.append({
-                        "content": content,
-                        "source": file_path.name
-                    })
-            except Exception as e:
-                logger.error(f"Error reading file {file_path}: {e}")
-    return documents
+                buffer.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
 
+    def produce():
+        try:
+            for item in items:
+                if not put("item", item):
+                    return
+        except Exception as e:
+            put("error", e)
+            return
+        put("done", None)
 
-def add_or_update_documents_to_weaviate(client: weaviate.Client, documents: List[Dict[str, str]]) -> None:
-    """
-    Add new documents to Weaviate or update existing ones.
+    producer = threading.Thread(target=produce, name="document-reader", daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
+        producer.join()
 
-    :param client: Weaviate client instance
-    :param documents: List of documents to add or update
-    """
-    added_count = 0
-    updated_count = 0
-    for document in documents:
-        if document_exists(client, document['source']):
-            update_document(client, document['source'], document['content'])
-            updated_count += 1
-        else:
-            client.data_object.create(
-                data_object=document,
-                class_name="Document"
-            )
-            added_count += 1
 
-    logger.info(f"Added {added_count} new documents and updated {updated_count} existing documents in Weaviate.")
+def entry_ids(entry: Dict) -> List[str]:
+    # Manifests written before chunking hold a single whole-document id
+    return entry.get("ids") or ([entry["id"]] if "id" in entry else [])
+
+
+def document_uuid(source: str, chunk_index: int) -> str:
+    """
+    Deterministic Weaviate id for a passage, derived from its source and position. Batch-importing an object with an
+    existing id replaces it, so upserts need no prior lookup.
+    """
+    return generate_uuid5(f"{source}#{chunk_index}", "Document")
+
 
+def _upload_pass(client: weaviate.Client, passages: Iterable[Dict], batch_size: int,
+                 num_workers: int) -> Tuple[int, Dict[str, Tuple[Dict, Any]]]:
+    """
+    Stream passages into the client's batch API once. Only passages whose batch has not been acknowledged yet are
+    held in memory, plus the ones that failed. An exception raised by passages itself propagates to the caller.
 
-def query_all_documents(client: weaviate.Client) -> List[Dict[str, str]]:
+    :return: (number of passages sent, failed passages and their errors by id)
     """
-    Query all documents from Weaviate.
+    in_flight = {}
+    failed = {}
+    sent = 0
+
+    def collect_results(results):
+        for item in results or []:
+            passage = in_flight.pop(item.get("id"), None)
+            errors = item.get("result", {}).get("errors")
+            if errors and passage is not None:
+                failed[item["id"]] = (passage, errors)
+
+    client.batch.configure(batch_size=batch_size, num_workers=num_workers, dynamic=False, callback=collect_results)
+    passages = iter(passages)
+    source_error = None
+
+    def next_passage():
+        # Errors of the passage stream (reading, chunking, embedding) are not batch failures: they end the pass and
+        # are re-raised once the passages already added have been flushed
+        nonlocal source_error
+        try:
+            return next(passages)
+        except StopIteration:
+            return None
+        except Exception as e:
+            source_error = e
+            return None
+
+    done = False
+    while not done:
+        try:
+            with client.batch as batch:
+                while True:
+                    passage = next_passage()
+                    if passage is None:
+                        done = True
+                        break
+                    uuid = document_uuid(passage['source'], passage['chunk_index'])
+                    in_flight[uuid] = passage
+                    sent += 1
+                    # An embedding computed at ingest time travels with the passage but is not a property
+                    properties = {key: value for key, value in passage.items() if key != "vector"}
+                    batch.add_data_object(data_object=properties, class_name="Document", uuid=uuid,
+                                          vector=passage.get("vector"))
+        except Exception as e:
+            # Carry on with the rest of the stream; the unacknowledged passages are retried afterwards
+            logger.error(f"Batch import failed: {e}")
+            failed.update((uuid, (passage, str(e))) for uuid, passage in in_flight.items())
+            in_flight.clear()
+    if source_error is not None:
+        raise source_error
+    failed.update((uuid, (passage, "no result returned")) for uuid, passage in in_flight.items())
+    return sent, failed
+
+
+def add_or_update_documents_to_weaviate(client: weaviate.Client, documents: Iterable[Dict],
+                                        batch_size: int = 100, num_workers: int = 2, max_retries: int = 3,
+                                        retry_delay: float = 1.0) -> List[str]:
+    """
+    Upsert passages through the client's batch API using deterministic ids. documents is consumed as a stream, so it
+    can be a generator over a corpus larger than memory. Objects Weaviate rejects are retried with exponential
+    backoff; objects of a failed batch request are retried too, which is safe because upserts are idempotent.
 
     :param client: Weaviate client instance
-    :return: List of all documents in Weaviate
+    :param documents: Passages (see chunking.chunk_document) to add or update
+    :param batch_size: Objects per batch request
+    :param num_workers: Parallel batch request workers
+    :param max_retries: Retry rounds for failed objects
+    :param retry_delay: Base delay in seconds between retry rounds
+    :return: Sources of the documents that could not be written
+    """
+    start = time.perf_counter()
+    total, failed = _upload_pass(client, documents, batch_size, num_workers)
+
+    for attempt in range(max_retries):
+        if not failed:
+            break
+        delay = (2 ** attempt) * retry_delay
+        logger.warning(f"{len(failed)} documents failed on attempt {attempt + 1}; retrying in {delay:.1f} seconds")
+        time.sleep(delay)
+        _, failed = _upload_pass(client, [passage for passage, _ in failed.values()], batch_size, num_workers)
+
+    elapsed = time.perf_counter() - start
+    written = total - len(failed)
+    for passage, errors in failed.values():
+        logger.error(f"Giving up on passage {passage['chunk_index']} of {passage['source']}: {errors}")
+    rate = written / elapsed if elapsed > 0 else float("inf")
+    logger.info(f"Upserted {written}/{total} passages in {elapsed:.2f}s ({rate:.1f} docs/sec)")
+    return sorted({passage['source'] for passage, _ in failed.values()})
+
+
+def delete_objects(client: weaviate.Client, ids) -> bool:
+    """Delete objects by id, logging failures. Returns True if every delete succeeded."""
+    ok = True
+    for obj_id in ids:
+        try:
+            client.data_object.delete(uuid=obj_id, class_name="Document")
+        except Exception as e:
+            logger.error(f"Error deleting object {obj_id}: {e}")
+            ok = False
+    return ok
+
+
+def delete_source_objects(client: weaviate.Client, source: str, min_chunk_index: Optional[int] = None) -> bool:
     """
+    Delete the objects of a source file with batch deletes filtered on source, instead of one request per passage.
+
+    :param min_chunk_index: Only delete passages from this chunk index on (the tail of a file that shrank)
+    :return: True if every matching object was deleted
+    """
+    where = {"path": ["source"], "operator": "Equal", "valueString": source}
+    if min_chunk_index is not None:
+        where = {"operator": "And", "operands": [
+            where, {"path": ["chunk_index"], "operator": "GreaterThanEqual", "valueInt": min_chunk_index},
+        ]}
     try:
-        query = (
-            client.query
-            .get("Document", ["content", "source"])
-            .with_limit(10000)  # Adjust this number based on your expected document count
-            .do()
-        )
+        while True:
+            results = client.batch.delete_objects(class_name="Document", where=where).get("results", {})
+            if results.get("failed"):
+                logger.error(f"Failed to delete {results['failed']} objects of {source}")
+                return False
+            # Each request deletes at most `limit` matches; repeat until a request is not capped
+            matches = results.get("matches", 0)
+            if not matches or matches < results.get("limit", 0):
+                return True
+    except Exception as e:
+        logger.error(f"Error deleting objects of {source}: {e}")
+        return False
 
-        # Log the full response for debugging
-        logger.debug(f"Full Weaviate response: {query}")
 
-        if 'data' not in query:
-            logger.error(f"Unexpected response structure: {query}")
-            return []
+def delete_stale_objects(client: weaviate.Client, expected_ids: Dict[str, List[str]], page_size: int = 1000) -> int:
+    """
+    Delete objects for the given sources whose id is not one of the expected passage ids, e.g. whole-document objects
+    from before chunking or objects with random ids. Scans only ids and sources, a page at a time.
 
-        if 'Get' not in query['data']:
-            logger.error(f"'Get' not found in response data: {query['data']}")
-            return []
+    :param expected_ids: Passage ids per source
+    :return: Number of objects deleted
+    """
+    expected = {source: set(ids) for source, ids in expected_ids.items()}
+    stale = []
+    cursor = None
+    while True:
+        query = client.query.get("Document", ["source"]).with_additional(["id"]).with_limit(page_size)
+        if cursor:
+            query = query.with_after(cursor)
+        objects = query.do().get("data", {}).get("Get", {}).get("Document") or []
+        if not objects:
+            break
+        for obj in objects:
+            obj_id = obj["_additional"]["id"]
+            if obj["source"] in expected and obj_id not in expected[obj["source"]]:
+                stale.append(obj_id)
+        cursor = objects[-1]["_additional"]["id"]
+
+    delete_objects(client, stale)
+    if stale:
+        logger.info(f"Deleted {len(stale)} stale objects")
+    return len(stale)
+
+
+def sync_documents(client: weaviate.Client, documents_dir: str, manifest_path: str, full: bool = False,
+                   include: Sequence[str] = ("*",), exclude: Sequence[str] = (), recursive: bool = False) -> bool:
+    """
+    Bring Weaviate in line with the documents directory: new or modified files are uploaded and files that
+    disappeared since the last run are deleted. Without a manifest (or with full=True) every file is uploaded and
+    objects with legacy ids are cleaned up.
 
-        if 'Document' not in query['data']['Get']:
-            logger.error(f"'Document' not found in Get data: {query['data']['Get']}")
-            return []
+    Files are read, chunked and uploaded as a stream through a bounded queue, so memory use does not grow with the
+    size of the corpus.
 
-        return query['data']['Get']['Document']
-    except Exception as e:
-        logger.error(f"Error querying documents from Weaviate: {str(e)}")
-        return []
+    :return: True if anything in Weaviate changed
+    """
+    if not Path(documents_dir).is_dir():
+        # A missing or unmounted directory would otherwise look like every document was removed
+        raise FileNotFoundError(f"Documents directory {documents_dir} is not a directory; not syncing")
+    weaviate_url = os.getenv("WEAVIATE_URL", "http://localhost:8080")
+    embedder = load_embedder(Config.EMBEDDER, Config.EMBEDDING_DIM)
+    embedder_spec = embedder.spec if embedder is not None else None
+    manifest = load_manifest(manifest_path, weaviate_url, embedder_spec)
+    files = {}
+    # New manifest entries (with passage ids) of the files streamed for upload
+    uploaded = {}
+    # Vanished files are only deleted after a scan that saw the whole directory
+    scan_complete = False
+
+    def passages():
+        nonlocal scan_complete
+        for document, entry in scan_documents(documents_dir, manifest, files, full=full, include=include,
+                                              exclude=exclude, recursive=recursive,
+                                              mmap_threshold=Config.INGEST_MMAP_THRESHOLD):
+            source = document['source']
+            try:
+                source_passages = chunk_document(document, Config.CHUNK_SIZE_CHARS, Config.CHUNK_OVERLAP_CHARS)
+                if embedder is not None and source_passages:
+                    vectors = embedder.embed([passage['content'] for passage in source_passages])
+                    for passage, vector in zip(source_passages, vectors):
+                        passage['vector'] = vector
+            except Exception as e:
+                # Like an unreadable file: keep its old passages tracked and retry it on the next run
+                logger.error(f"Error preparing {source} for upload: {e}")
+                if source in manifest:
+                    files[source] = manifest[source]
+                continue
+            uploaded[source] = {
+                **entry,
+                "ids": [document_uuid(source, passage['chunk_index']) for passage in source_passages],
+            }
+            yield from source_passages
+        scan_complete = True
+
+    failed = set(add_or_update_documents_to_weaviate(
+        client,
+        prefetch(passages(), Config.INGEST_QUEUE_SIZE),
+        batch_size=Config.INGEST_BATCH_SIZE,
+        num_workers=Config.INGEST_WORKERS,
+        max_retries=Config.INGEST_MAX_RETRIES,
+        retry_delay=Config.INGEST_RETRY_DELAY,
+    ))
+    if not scan_complete:
+        raise RuntimeError("Document scan did not finish; skipping deletions and the manifest update")
+    vanished = [source for source in manifest if source not in files and source not in uploaded]
+    logger.info(f"Scan: {len(uploaded)} new or modified, {len(files)} unchanged, {len(vanished)} removed")
+    if vanished and len(vanished) == len(manifest) and not full:
+        # Every known file gone at once is far more likely a wrong path or filter than an intended wipe
+        logger.error(f"All {len(vanished)} known documents are missing from {documents_dir}; not deleting them. "
+                     f"Run with --full to sync the directory as it is.")
+        # Keep their entries so they are still tracked
+        files.update((source, manifest[source]) for source in vanished)
+        vanished = []
+
+    for source, entry in uploaded.items():
+        if source in failed:
+            # Keep the old entry so its passages are still tracked; the stat mismatch retries the file next run
+            if source in manifest:
+                files[source] = manifest[source]
+            continue
+        files[source] = entry
+        old = manifest.get(source)
+        if old is None:
+            continue
+        if "ids" in old:
+            # Passages past the new end of a shrunken file
+            if len(old["ids"]) > len(entry["ids"]):
+                delete_source_objects(client, source, min_chunk_index=len(entry["ids"]))
+        else:
+            # Whole-document object from a manifest written before chunking
+            delete_objects(client, entry_ids(old))
+    if uploaded and (full or not manifest):
+        delete_stale_objects(client, {
+            source: entry["ids"] for source, entry in uploaded.items() if source not in failed
+        })
+
+    for source in vanished:
+        if delete_source_objects(client, source):
+            logger.info(f"Deleted removed document: {source}")
+        else:
+            # Keep the entry so the deletion is retried on the next run
+            files[source] = manifest[source]
+
+    save_manifest(manifest_path, weaviate_url, files, embedder_spec)
+    return bool(uploaded or vanished)
 
 
-def create_and_populate_document_store(documents_dir: str) -> None:
+def build_local_index(documents_dir: str, index_path: str, full: bool = False, include: Sequence[str] = ("*",),
+                      exclude: Sequence[str] = (), recursive: bool = False) -> bool:
     """
-    Create Weaviate schema, populate it with documents, and then query all documents.
+    Rebuild the local BM25 index (see bm25_index.py), and its passage vectors when Config.EMBEDDER is set, from the
+    documents directory. The index records the size and mtime of every file it was built from, plus the chunking and
+    embedder settings, and is only rebuilt when those change.
 
-    :param documents_dir: Path to the directory containing documents
+    :return: True if the index was rebuilt
     """
-    try:
-        # Initialize Weaviate client
-        client = weaviate.Client(os.getenv("WEAVIATE_URL", "http://localhost:8080"))
+    stats = []
+    for source, file_path in iter_document_files(documents_dir, include, exclude, recursive):
+        try:
+            stat = file_path.stat()
+        except OSError:
+            continue
+        stats.append(f"{source}\0{stat.st_size}\0{stat.st_mtime_ns}")
+    embedder = load_embedder(Config.EMBEDDER, Config.EMBEDDING_DIM)
+    stats.append(f"chunking\0{Config.CHUNK_SIZE_CHARS}\0{Config.CHUNK_OVERLAP_CHARS}")
+    stats.append(f"embedder\0{embedder.spec if embedder is not None else ''}")
+    signature = hashlib.sha256("\n".join(stats).encode("utf-8")).hexdigest()
+    if not full and read_index_signature(index_path) == signature:
+        logger.info(f"Local index at {index_path} is up to date")
+        return False
 
-        # Create schema
-        create_schema(client)
+    def passages():
+        for document, _ in scan_documents(documents_dir, {}, {}, full=True, include=include, exclude=exclude,
+                                          recursive=recursive, mmap_threshold=Config.INGEST_MMAP_THRESHOLD):
+            yield from chunk_document(document, Config.CHUNK_SIZE_CHARS, Config.CHUNK_OVERLAP_CHARS)
 
-        # Read documents
-        documents = read_documents(documents_dir)
+    start = time.perf_counter()
+    count = build_index(prefetch(passages(), Config.INGEST_QUEUE_SIZE), index_path, signature=signature,
+                        embedder=embedder, ivf_min_vectors=Config.VECTOR_IVF_MIN_VECTORS)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    logger.info(f"Indexed {count} passages in {elapsed:.2f}s ({rate:.1f} docs/sec)")
+    return True
 
-        if documents:
-            # Add or update documents in Weaviate
-            add_or_update_documents_to_weaviate(client, documents)
-        else:
-            logger.warning("No documents found in the specified directory.")
 
-        # Query all documents from Weaviate
-        all_documents = query_all_documents(client)
+def sync_pass(client, documents_dir: str, manifest_path: str, full: bool, include: Sequence[str],
+              exclude: Sequence[str], recursive: bool) -> None:
+    """
+    Run one sync of the documents directory into Weaviate, or into the local index when client is None, and bump the
+    corpus version if anything changed.
+    """
+    if not Path(documents_dir).is_dir():
+        raise FileNotFoundError(f"Documents directory {documents_dir} is not a directory; not syncing")
+    if next(iter_document_files(documents_dir, include, exclude, recursive), None) is None:
+        logger.warning("No documents found in the specified directory.")
+    if client is None:
+        changed = build_local_index(documents_dir, Config.LOCAL_INDEX_PATH, full=full, include=include,
+                                    exclude=exclude, recursive=recursive)
+    else:
+        changed = sync_documents(client, documents_dir, manifest_path, full=full, include=include,
+                                 exclude=exclude, recursive=recursive)
+    if changed:
+        # Signal running API servers to drop cached retrieval results (and reload a local index)
+        bump_corpus_version(Config.CORPUS_VERSION_FILE)
+
+    if client is not None:
+        # Count documents in Weaviate without downloading their content
+        result = client.query.aggregate("Document").with_meta_count().do()
+        total = result["data"]["Aggregate"]["Document"][0]["meta"]["count"]
+        logger.info(f"Total documents in Weaviate: {total}")
+
+
+def create_and_populate_document_store(documents_dir: str, manifest_path: str = None, full: bool = False,
+                                       watch: bool = False, interval: float = 30, include: Sequence[str] = ("*",),
+                                       exclude: Sequence[str] = (), recursive: bool = False,
+                                       backend: str = None) -> None:
+    """
+    Create Weaviate schema, sync it with the documents directory, and report the document count. With the "local"
+    backend, build the embedded BM25 index at Config.LOCAL_INDEX_PATH instead; no Weaviate instance is needed.
+
+    :param documents_dir: Path to the directory containing documents
+    :param manifest_path: Ingestion manifest used for incremental syncs (defaults to Config.INGEST_MANIFEST_PATH)
+    :param full: Ignore the manifest and upload every file
+    :param watch: Keep running and re-sync every interval seconds
+    :param interval: Seconds between syncs in watch mode
+    :param include: Glob patterns of files to ingest
+    :param exclude: Glob patterns of files to leave out
+    :param recursive: Descend into subdirectories
+    :param backend: "weaviate" or "local" (defaults to Config.RETRIEVER_BACKEND)
+    """
+    manifest_path = manifest_path or Config.INGEST_MANIFEST_PATH
+    backend = backend or Config.RETRIEVER_BACKEND
+    try:
+        client = None
+        if backend != "local":
+            # Initialize Weaviate client
+            client = weaviate.Client(os.getenv("WEAVIATE_URL", "http://localhost:8080"))
+
+            # Create schema
+            create_schema(client)
+
+        while True:
+            try:
+                sync_pass(client, documents_dir, manifest_path, full=full, include=include, exclude=exclude,
+                          recursive=recursive)
+                full = False
+            except Exception as e:
+                # In watch mode a failed pass (Weaviate unavailable, unreadable file) is retried on the next one
+                logger.error(f"Error syncing the document store: {str(e)}")
+                logger.exception("Full traceback:")
 
-        logger.info(f"Total documents in Weaviate: {len(all_documents)}")
-        for i, doc in enumerate(all_documents, 1):
-            logger.info(f"Document {i}:")
-            logger.info(f"  Source: {doc['source']}")
-            logger.info(f"  Content: {doc['content'][:100]}...")  # First 100 characters
-            logger.info("---")
+            if not watch:
+                break
+            time.sleep(interval)
 
+    except KeyboardInterrupt:
+        logger.info("Stopped watching for document changes.")
     except Exception as e:
         logger.error(f"Error creating and populating document store: {str(e)}")
         logger.exception("Full traceback:")
 
 
 def main():
-    documents_dir = "documents"  # Create this directory and add your documents
-    create_and_populate_document_store(documents_dir)
+    parser = argparse.ArgumentParser(description="Create the Weaviate schema and sync it with a documents directory.")
+    # Create this directory and add your documents
+    parser.add_argument("--documents-dir", default="documents", help="Directory containing documents")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-upload every file")
+    parser.add_argument("--watch", action="store_true", help="Keep running and re-sync on an interval")
+    parser.add_argument("--interval", type=float, default=30, help="Seconds between syncs in --watch mode")
+    parser.add_argument("--recursive", action="store_true", help="Also ingest files in subdirectories")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="Only ingest files matching this pattern, e.g. '*.md' (repeatable; default: all files)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                        help="Skip files matching this pattern (repeatable)")
+    parser.add_argument("--backend", choices=["weaviate", "local"], default=Config.RETRIEVER_BACKEND,
+                        help="Ingest into Weaviate or build the local BM25 index (default: RETRIEVER_BACKEND)")
+    args = parser.parse_args()
+
+    create_and_populate_document_store(
+        args.documents_dir,
+        full=args.full,
+        watch=args.watch,
+        interval=args.interval,
+        include=args.include or ["*"],
+        exclude=args.exclude,
+        recursive=args.recursive,
+        backend=args.backend,
+    )
     logger.info("Document store creation, population, and query process completed.")
 
 